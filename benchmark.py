@@ -0,0 +1,193 @@
+
+# =============================================================================
+"""Micro-benchmarks for the encoding and field comparison functions.
+
+   Each function is run over values drawn from the census and restaurant data
+   sets (and over synthetic long strings). For each function the number of
+   calls per second and percentiles of the time per call (over the input
+   values) are reported.
+
+   Usage: python benchmark.py [-save FILE] [-compare FILE] [-tolerance PERC]
+
+   -save FILE       Save the results as a baseline file.
+   -compare FILE    Compare the results with a saved baseline file, and exit
+                    with status 1 if a function is slower by more than the
+                    tolerance.
+   -tolerance PERC  Allowed slow-down in percent (default 10).
+"""
+
+# =============================================================================
+
+import argparse
+import json
+import sys
+import timeit
+
+import comparison
+import encode
+import testdata
+
+# =============================================================================
+
+NUM_VALUES     = 2000  # Number of input values (or value pairs) per benchmark
+NUM_CALL_REPS  = 20    # Number of calls timed per input value
+NUM_TIME_RUNS  = 3     # Timing runs per input value, the fastest is used
+NUM_LONG_STRS  = 200   # Number of synthetic long strings
+LONG_STR_RANGE = (50, 200)
+
+PERCENTILE_LIST = [50, 90, 99]
+
+# =============================================================================
+# Values from the data sets and synthetic long strings
+
+name_val_list = testdata.get_field_values(testdata.census_ds,
+                                          testdata.CENSUS_NAME_FIELD_LIST)
+rest_val_list = testdata.get_field_values(testdata.rest_ds,
+                                          testdata.REST_NAME_FIELD_LIST)
+
+rand = testdata.rand
+
+long_val_list = []
+
+for i in range(NUM_LONG_STRS):
+    long_val_list.append(''.join([rand.choice('abcdefghijklmnopqrstuvwxyz ') \
+                                  for j in range(rand.randint(*LONG_STR_RANGE))]))
+
+mixed_val_list = testdata.sample_values(name_val_list, NUM_VALUES/2) + \
+                 testdata.sample_values(rest_val_list, NUM_VALUES/4) + \
+                 testdata.sample_values(long_val_list, NUM_VALUES/4)
+
+mixed_pair_list = testdata.sample_value_pairs(name_val_list, NUM_VALUES/2) + \
+                  testdata.sample_value_pairs(rest_val_list, NUM_VALUES/4) + \
+                  testdata.sample_value_pairs(long_val_list, NUM_VALUES/4)
+
+# =============================================================================
+# Benchmark definitions: (name, function, list of argument tuples)
+
+jaro_comp  = comparison.FieldComparatorJaro(thres=0, backend='python',
+                                            desc = 'jaro')
+exact_comp = comparison.FieldComparatorExactString(desc = 'exact')
+
+benchmark_list = [
+  ('encode.nysiis',              encode.nysiis,
+   [(val, 4) for val in mixed_val_list]),
+  ('encode.soundex',             encode.soundex,
+   [(val, 4) for val in mixed_val_list]),
+  ('encode.metaphone',           encode.metaphone,
+   [(val, 4) for val in mixed_val_list]),
+  ('encode.sorted_qgram_prefix', encode.sorted_qgram_prefix,
+   [(val, 2, 3) for val in mixed_val_list]),
+  ('encode.get_substring',       encode.get_substring,
+   [(val, 0, 3) for val in mixed_val_list]),
+  ('FieldComparatorJaro.compare', jaro_comp.compare,
+   mixed_pair_list),
+  ('FieldComparatorExactString.compare', exact_comp.compare,
+   mixed_pair_list),
+]
+
+if (comparison.jellyfish != None):  # Also benchmark the accelerated backend
+    jaro_jf_comp = comparison.FieldComparatorJaro(thres=0, backend='jellyfish',
+                                                  desc = 'jaro jellyfish')
+    benchmark_list.append(('FieldComparatorJaro.compare (jellyfish)',
+                           jaro_jf_comp.compare, mixed_pair_list))
+
+# =============================================================================
+
+def run_benchmark(funct, arg_list):
+    """Time the function for each argument tuple, and return a dictionary with
+       the calls per second and percentiles of the time per call in
+       microseconds. Each argument tuple is timed several times and the fastest
+       time is used, to reduce the influence of other processes.
+    """
+
+    timer = timeit.default_timer
+
+    call_time_list = []
+
+    for args in arg_list:
+        min_time = None
+
+        for run in xrange(NUM_TIME_RUNS):
+            start_time = timer()
+
+            for i in xrange(NUM_CALL_REPS):
+                funct(*args)
+
+            run_time = timer() - start_time
+
+            if (min_time == None) or (run_time < min_time):
+                min_time = run_time
+
+        call_time_list.append(min_time / NUM_CALL_REPS)
+
+    res_dict = {'ops_per_sec': len(call_time_list) / sum(call_time_list)}
+
+    call_time_list.sort()
+
+    for perc in PERCENTILE_LIST:
+        perc_index = min(len(call_time_list)-1, len(call_time_list)*perc/100)
+
+        res_dict['p%d_us' % (perc)] = call_time_list[perc_index] * 1000000.0
+
+    return res_dict
+
+# =============================================================================
+
+arg_parser = argparse.ArgumentParser(description='Micro-benchmarks for ' + \
+                                     'encoding and field comparison functions')
+arg_parser.add_argument('-save', metavar='FILE',
+                        help='save results as a baseline file')
+arg_parser.add_argument('-compare', metavar='FILE',
+                        help='compare results with a baseline file')
+arg_parser.add_argument('-tolerance', metavar='PERC', type=float, default=10.0,
+                        help='allowed slow-down in percent (default 10)')
+args = arg_parser.parse_args()
+
+if (args.compare != None):
+    baseline_dict = json.load(open(args.compare))
+else:
+    baseline_dict = {}
+
+result_dict = {}
+
+num_slower = 0
+
+header_str = '%-40s %12s %9s %9s %9s' % ('Function', 'ops/sec', 'p50 us',
+                                         'p90 us', 'p99 us')
+if (baseline_dict != {}):
+    header_str += '  vs. baseline'
+
+print header_str
+
+for (bench_name, funct, arg_list) in benchmark_list:
+
+    res_dict = run_benchmark(funct, arg_list)
+
+    result_dict[bench_name] = res_dict
+
+    res_str = '%-40s %12.0f %9.2f %9.2f %9.2f' % (bench_name,
+              res_dict['ops_per_sec'], res_dict['p50_us'], res_dict['p90_us'],
+              res_dict['p99_us'])
+
+    if (bench_name in baseline_dict):
+        base_ops = baseline_dict[bench_name]['ops_per_sec']
+
+        change_perc = 100.0 * (res_dict['ops_per_sec'] - base_ops) / base_ops
+
+        res_str += '  %+7.1f%%' % (change_perc)
+
+        if (change_perc < -args.tolerance):
+            res_str += '  SLOWER'
+            num_slower += 1
+
+    print res_str
+
+if (args.save != None):
+    json.dump(result_dict, open(args.save, 'w'), indent=2, sort_keys=True)
+
+    print 'Results saved to baseline file "%s"' % (args.save)
+
+if (num_slower > 0):
+    print '%d function(s) slower than the baseline by more than %.1f%%' % \
+          (num_slower, args.tolerance)
+    sys.exit(1)
@@ -9,13 +9,43 @@
 # =============================================================================
 # Import necessary modules (Python standard modules first, then Febrl modules)
 
+import copy
 import logging
+import math
+
+import encode
+
+try:  # Accelerated string similarity functions are used if available
+    import jellyfish
+except ImportError:
+    jellyfish = None
+
+if (jellyfish != None):  # Renamed in newer versions of jellyfish
+    jellyfish_jaro = getattr(jellyfish, 'jaro_similarity', None) or \
+                     jellyfish.jaro_distance
+else:
+    jellyfish_jaro = None
+
+APPROX_BACKEND_LIST = ['auto', 'python', 'jellyfish']
+
+CUT_OFF_TOLERANCE = 1.0E-9  # Pairs are only abandoned if their maximum weight
+                            # is below the cut-off by more than this, as the
+                            # weights are summed in a different order
 
 # =============================================================================
 
 class RecordComparator:
     """Class that implements a record comparator to compare two records and
      compute (and return) a weight vector.
+
+     Weight vectors can either be returned as lists, or written into rows of a
+     preallocated array of doubles, so the weight vectors of many record pairs
+     can be kept in one contiguous matrix.
+
+     With compare_cut_off() the comparison of a record pair is abandoned as
+     soon as its matching weight cannot reach a cut-off threshold anymore. The
+     numbers of abandoned record pairs and of skipped field comparisons are
+     counted in 'num_cut_off_rec_pairs' and 'num_skipped_field_comp'.
     """
     # ---------------------------------------------------------------------------
 
@@ -65,6 +95,180 @@ class RecordComparator:
 
         assert len(self.field_comparison_list) == len(self.field_comparator_list)
 
+        self.num_fields = len(self.field_comparison_list)  # Weight vector length
+
+        self.rec_length1 = len(dataset1.field_list)  # Shorter records are padded
+
+        self.rec_length2 = len(dataset2.field_list)
+
+        # Field comparisons in the order used by compare_cut_off(), exact string
+        # comparisons (the cheapest) first. Each entry also holds the position of
+        # the weight in the weight vector, the number of comparisons after it,
+        # and the sum of their maximum weights.
+        #
+        comp_order_list = []
+
+        for field_num in range(self.num_fields):
+            field_comp = self.field_comparator_list[field_num][0]
+
+            if (isinstance(field_comp, FieldComparatorExactString)):
+                comp_order_list.append((0, field_num))
+            else:
+                comp_order_list.append((1, field_num))
+
+        comp_order_list.sort()
+
+        self.cut_off_comparison_list = []
+
+        rest_max_weight = 0.0
+
+        num_rest_comp = 0
+
+        for (comp_cost, field_num) in reversed(comp_order_list):
+            (comp_funct, field_col1, field_col2) = self.field_comparison_list[field_num]
+
+            self.cut_off_comparison_list.insert(0, (comp_funct, field_col1, field_col2,
+                                                    field_num, num_rest_comp,
+                                                    rest_max_weight))
+
+            rest_max_weight += self.field_comparator_list[field_num][0].get_max_weight()
+
+            num_rest_comp += 1
+
+        self.num_cut_off_rec_pairs = 0
+
+        self.num_skipped_field_comp = 0
+
+    # ---------------------------------------------------------------------------
+
+    def compare(self, rec1, rec2):
+        """Compare two records (lists of field values) and return the weight
+           vector as a list with one weight per field comparator. Missing values
+           at the end of short records are compared as empty strings.
+        """
+
+        if (len(rec1) < self.rec_length1):
+            rec1 = self.__pad_rec__(rec1, self.rec_length1)
+
+        if (len(rec2) < self.rec_length2):
+            rec2 = self.__pad_rec__(rec2, self.rec_length2)
+
+        return [comp_funct(rec1[field_col1], rec2[field_col2]) for \
+                (comp_funct, field_col1, field_col2) in self.field_comparison_list]
+
+    # ---------------------------------------------------------------------------
+
+    def compare_into(self, rec1, rec2, w_vec_array, offset):
+        """Compare two records and write the weights into the given array (for
+           example an array.array('d')) starting at the given offset, instead of
+           returning a new list. Returns the sum of the weights (the matching
+           weight of the record pair).
+        """
+
+        if (len(rec1) < self.rec_length1):
+            rec1 = self.__pad_rec__(rec1, self.rec_length1)
+
+        if (len(rec2) < self.rec_length2):
+            rec2 = self.__pad_rec__(rec2, self.rec_length2)
+
+        w_sum = 0.0
+
+        pos = offset
+
+        for (comp_funct, field_col1, field_col2) in self.field_comparison_list:
+            w = comp_funct(rec1[field_col1], rec2[field_col2])
+
+            w_vec_array[pos] = w
+
+            w_sum += w
+
+            pos += 1
+
+        return w_sum
+
+    # ---------------------------------------------------------------------------
+
+    def compare_cut_off(self, rec1, rec2, cut_off_threshold):
+        """Compare two records like compare(), but return None as soon as the sum
+           of the weights computed so far and the maximum weights of the fields
+           not compared yet is below the given cut-off threshold. Exact string
+           comparisons are done first, as they are the cheapest.
+        """
+
+        if (len(rec1) < self.rec_length1):
+            rec1 = self.__pad_rec__(rec1, self.rec_length1)
+
+        if (len(rec2) < self.rec_length2):
+            rec2 = self.__pad_rec__(rec2, self.rec_length2)
+
+        w_vec = [0.0] * self.num_fields
+
+        w_sum = 0.0
+
+        cut_off_bound = cut_off_threshold - CUT_OFF_TOLERANCE
+
+        for (comp_funct, field_col1, field_col2, field_num, num_rest_comp,
+             rest_max_weight) in self.cut_off_comparison_list:
+
+            w = comp_funct(rec1[field_col1], rec2[field_col2])
+
+            w_vec[field_num] = w
+
+            w_sum += w
+
+            if (w_sum + rest_max_weight < cut_off_bound):  # Cannot be reached
+                self.num_cut_off_rec_pairs += 1
+                self.num_skipped_field_comp += num_rest_comp
+                return None
+
+        return w_vec
+
+    # ---------------------------------------------------------------------------
+
+    def get_projected_comparator(self, field_col_list1, field_col_list2):
+        """Return a copy of the record comparator that compares records which
+           only contain the values of the given field columns (in the given
+           order) of data set 1 and data set 2, instead of the values of all
+           fields. The field columns must include all compared fields.
+        """
+
+        proj_rec_comp = copy.copy(self)
+
+        proj_rec_comp.field_comparison_list = []
+
+        for (comp_funct, field_col1, field_col2) in self.field_comparison_list:
+            proj_rec_comp.field_comparison_list.append((comp_funct,
+                                                        field_col_list1.index(field_col1),
+                                                        field_col_list2.index(field_col2)))
+
+        proj_rec_comp.cut_off_comparison_list = []
+
+        for (comp_funct, field_col1, field_col2, field_num, num_rest_comp,
+             rest_max_weight) in self.cut_off_comparison_list:
+            proj_rec_comp.cut_off_comparison_list.append((comp_funct,
+                field_col_list1.index(field_col1), field_col_list2.index(field_col2),
+                field_num, num_rest_comp, rest_max_weight))
+
+        proj_rec_comp.rec_length1 = len(field_col_list1)
+
+        proj_rec_comp.rec_length2 = len(field_col_list2)
+
+        proj_rec_comp.num_cut_off_rec_pairs = 0
+
+        proj_rec_comp.num_skipped_field_comp = 0
+
+        return proj_rec_comp
+
+    # ---------------------------------------------------------------------------
+
+    def __pad_rec__(self, rec, rec_length):
+        """Return the record padded with empty strings to the given length (the
+           number of fields of its data set). Should not be used from outside the
+           module.
+        """
+
+        return list(rec) + [''] * (rec_length - len(rec))
+
 # =============================================================================
 
 class FieldComparator:
@@ -74,6 +278,22 @@ class FieldComparator:
         set when a field comparator is initialised:
 
         description      A string describing the field comparator.
+        do_caching       If set to True the weights of compared value pairs
+                         are cached, so value pairs that are compared again
+                         are not compared again. Default is False.
+        max_cache_size   The maximum number of cached value pairs, when the
+                         cache is full the least recently used pair is removed
+                         (see encode.LRUCache). If set to None the cache is not
+                         bounded. Default is 100000.
+        symmetric_cache  If set to True the cache is keyed on the unordered
+                         value pair, so a comparison of (b,a) uses the cached
+                         weight of (a,b). Only valid for comparators that are
+                         symmetric. Default is False.
+        freq_weights     If set to True the agreement weight depends on the
+                         frequency of the agreeing value in the data set, see
+                         set_value_frequencies(). The value frequencies are
+                         counted when an index using the comparator is built.
+                         Default is False.
     """
 
     # ---------------------------------------------------------------------------
@@ -94,6 +314,16 @@ class FieldComparator:
 
         self.disagree_weight =  0.0
 
+        self.do_caching      =  False  # No caching of compared value pairs
+
+        self.max_cache_size  =  100000
+
+        self.symmetric_cache =  False
+
+        self.freq_weights    =  False  # Same agreement weight for all values
+
+        self.freq_weight_dict = None  # Agreement weights of frequent values
+
         # Process base keyword arguments (all data set specific keywords were
         # processed in the derived class constructor)
         #
@@ -101,22 +331,171 @@ class FieldComparator:
             if (keyword.startswith('desc')):
                 self.description = value
 
+            elif (keyword.startswith('do_cach')):
+                if (value not in [True, False]):
+                    logging.exception('Argument "do_caching" must be True or ' + \
+                                      'False: %s' % (str(value)))
+                    raise Exception
+                self.do_caching = value
+
+            elif (keyword.startswith('max_cache')):
+                if ((value != None) and ((not isinstance(value, int)) or \
+                                         (value < 1))):
+                    logging.exception('Argument "max_cache_size" must be None ' + \
+                                      'or a positive integer: %s' % (str(value)))
+                    raise Exception
+                self.max_cache_size = value
+
+            elif (keyword.startswith('symm')):
+                if (value not in [True, False]):
+                    logging.exception('Argument "symmetric_cache" must be True ' + \
+                                      'or False: %s' % (str(value)))
+                    raise Exception
+                self.symmetric_cache = value
+
+            elif (keyword.startswith('freq')):
+                if (value not in [True, False]):
+                    logging.exception('Argument "freq_weights" must be True or ' + \
+                                      'False: %s' % (str(value)))
+                    raise Exception
+                self.freq_weights = value
+
             else:
                 logging.exception('Illegal constructor argument keyword: %s' % \
                           (str(keyword)))
                 raise Exception
 
+        self.clear_cache()
+
+    # ---------------------------------------------------------------------------
+
+    def get_max_weight(self):
+        """Return the largest weight the comparator can return (frequency based
+           agreement weights are never larger than the agreement weight).
+        """
+
+        return max(self.agree_weight, self.disagree_weight, self.missing_weight)
+
+    # ---------------------------------------------------------------------------
+
+    def clear_cache(self):
+        """Remove all cached weights and reset the cache counters.
+        """
+
+        self.value_pair_cache = encode.LRUCache(self.max_cache_size)
+
+    # ---------------------------------------------------------------------------
+
+    def get_cache_stats(self):
+        """Return a dictionary with the number of cache hits, misses and
+           evictions, the hit rate, and the number of cached value pairs.
+        """
+
+        return self.value_pair_cache.get_stats()
+
+    # ---------------------------------------------------------------------------
+
+    def __get_from_cache__(self, val1, val2):
+        """Return the cached weight of the value pair, or None if the pair is not
+           in the cache. Should not be used from outside the module.
+        """
+
+        if ((self.symmetric_cache == True) and (val1 > val2)):
+            return self.value_pair_cache.get((val2, val1))
+
+        return self.value_pair_cache.get((val1, val2))
+
+    # ---------------------------------------------------------------------------
+
+    def __put_into_cache__(self, val1, val2, w):
+        """Put the weight of the value pair into the cache. Should not be used
+           from outside the module.
+        """
+
+        if ((self.symmetric_cache == True) and (val1 > val2)):
+            self.value_pair_cache.put((val2, val1), w)
+        else:
+            self.value_pair_cache.put((val1, val2), w)
+
+    # ---------------------------------------------------------------------------
+
+    def set_value_frequencies(self, value_list, count_list):
+        """Compute the frequency based agreement weights from the given list of
+           distinct values and the list with the number of records that have each
+           value.
+
+           With N the number of records with a non-missing value, the agreement
+           weight of a value that occurs in c records is:
+
+             agree_weight * log(N / c) / log(N)
+
+           So a value that occurs in only one record gets the full agreement
+           weight, and a value that occurs in all records gets a weight of 0.
+           Only the weights of values that occur in more than one record are
+           kept, all other values get the full agreement weight. The value pair
+           cache is cleared, as cached weights may be based on other
+           frequencies.
+        """
+
+        if (len(value_list) != len(count_list)):
+            logging.exception('Value list and count list have different lengths')
+            raise Exception
+
+        missing_values = self.missing_values
+
+        num_values = 0
+
+        for i in xrange(len(value_list)):
+            if (value_list[i] not in missing_values):
+                num_values += count_list[i]
+
+        self.freq_weight_dict = {}
+
+        self.clear_cache()
+
+        if (num_values < 2):  # All values get the agreement weight
+            return
+
+        log_num_values = math.log(num_values)
+
+        agree_weight = self.agree_weight
+
+        for i in xrange(len(value_list)):
+            count = count_list[i]
+
+            if ((count > 1) and (value_list[i] not in missing_values)):
+                self.freq_weight_dict[value_list[i]] = agree_weight * \
+                    math.log(float(num_values) / count) / log_num_values
+
     # ---------------------------------------------------------------------------
 
     def __calc_freq_agree_weight__(self, val):
+        """Return the agreement weight of the given value. Should not be used
+           from outside the module.
+        """
+
+        if (self.freq_weight_dict == None):
+            return self.agree_weight
 
-        return self.agree_weight
+        return self.freq_weight_dict.get(val, self.agree_weight)
 
     # ---------------------------------------------------------------------------
 
     def __calc_freq_weights__(self, val1, val2):
+        """Return the agreement weight of two (different) values, which is the
+           agreement weight of the more frequent value. Should not be used from
+           outside the module.
+        """
+
+        if (self.freq_weight_dict == None):
+            return self.agree_weight
+
+        agree_weight = self.agree_weight
 
-        return self.agree_weight
+        freq_weight_dict = self.freq_weight_dict
+
+        return min(freq_weight_dict.get(val1, agree_weight),
+                   freq_weight_dict.get(val2, agree_weight))
 
     # ---------------------------------------------------------------------------
     def compare(self, val1, val2):
@@ -156,6 +535,19 @@ class FieldComparatorExactString(FieldComparator):
 # =============================================================================
 
 class FieldComparatorApproxString(FieldComparator):
+    """Base class for approximate string field comparators.
+
+       The 'backend' argument selects the implementation of the similarity
+       function: 'auto' (the default) to use the (C) implementation of the
+       jellyfish module if it is installed and the implementation in this
+       module otherwise, 'jellyfish' to always use jellyfish, or 'python' to
+       always use the implementation in this module. The jellyfish module
+       counts common characters and transpositions slightly differently, so its
+       similarities (and thus the partial agreement weights) can differ from
+       the ones of the Python implementation by up to about 0.06. Callers that
+       need the same weights whether jellyfish is installed or not should
+       select the 'python' backend.
+    """
 
     # ---------------------------------------------------------------------------
 
@@ -163,6 +555,8 @@ class FieldComparatorApproxString(FieldComparator):
 
         self.threshold = None
 
+        self.backend   = 'auto'
+
         # Process all keyword arguments - - - - - - - - - - - - - - - - - - - - - -
         #
         base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
@@ -175,11 +569,29 @@ class FieldComparatorApproxString(FieldComparator):
                             'then 1.0: %s' % (value))
                     raise Exception
                 self.threshold = float(value)
+
+            elif (keyword.startswith('backend')):
+                if (value not in APPROX_BACKEND_LIST):
+                    logging.exception('Illegal "backend" value: %s' % (str(value)))
+                    raise Exception
+                self.backend = value
+
             else:
                 base_kwargs[keyword] = value
 
         FieldComparator.__init__(self, base_kwargs)  # Process base arguments
 
+        if (self.backend == 'auto'):
+            if (jellyfish != None):
+                self.backend = 'jellyfish'
+            else:
+                self.backend = 'python'
+
+        elif ((self.backend == 'jellyfish') and (jellyfish == None)):
+            logging.exception('Backend "jellyfish" selected, but the jellyfish ' + \
+                              'module is not installed')
+            raise Exception
+
     # ---------------------------------------------------------------------------
 
     def __calc_partagree_weight__(self, val1, val2, approx_sim_val):
@@ -206,6 +618,12 @@ class FieldComparatorApproxString(FieldComparator):
 
 class FieldComparatorJaro(FieldComparatorApproxString):
     """A field comparator based on the Jaro approximate string comparator.
+
+       With the Python backend and a threshold larger than 0, value pairs whose
+       Jaro similarity cannot reach the threshold are given the disagreement
+       weight without running the matching loop. An upper bound of the
+       similarity is computed from the string lengths and the number of
+       characters of each string that occur anywhere in the other string.
     """
 
     # ---------------------------------------------------------------------------
@@ -215,9 +633,6 @@ class FieldComparatorJaro(FieldComparatorApproxString):
         """
         FieldComparatorApproxString.__init__(self, kwargs)
 
-        self.JARO_MARKER_CHAR = chr(1)  # Special character used to mark assigned
-                                    # characters
-
     # ---------------------------------------------------------------------------
 
     def compare(self, val1, val2):
@@ -233,57 +648,137 @@ class FieldComparatorJaro(FieldComparatorApproxString):
         if (val1 == val2):
             return self.__calc_freq_agree_weight__(val1)
 
-        # Calculate Jaro similarity value - - - - - - - - - - - - - - - - - - - - -
-        #
+        if (self.do_caching == True):  # Check if the values pair is cached
+            w = self.__get_from_cache__(val1, val2)
+            if (w != None):
+                return w
+
+        if (self.backend == 'jellyfish'):  # Needs unicode strings
+            if (isinstance(val1, str)):
+                jaro_sim = jellyfish_jaro(val1.decode('latin-1'), val2.decode('latin-1'))
+            else:
+                jaro_sim = jellyfish_jaro(val1, val2)
+
+        elif ((self.threshold > 0.0) and \
+              (self.__jaro_upper_bound__(val1, val2) < self.threshold)):
+            jaro_sim = None  # Threshold cannot be reached
+
+        else:
+            jaro_sim = self.__jaro_python__(val1, val2)
+
+        if ((jaro_sim == None) or (jaro_sim == 0.0)):  # Below threshold or no
+            w = self.disagree_weight                    # characters in common
+        else:
+            w = self.__calc_partagree_weight__(val1, val2, jaro_sim)
+
+        if (self.do_caching == True):  # Put values pair into the cache
+            self.__put_into_cache__(val1, val2, w)
+
+        return w
+
+    # ---------------------------------------------------------------------------
+
+    def __jaro_upper_bound__(self, val1, val2):
+        """Return an upper bound of the Jaro similarity of two strings, computed
+           as the similarity if all characters of the strings that also occur in
+           the other string were common and there were no transpositions. Should
+           not be used from outside the module.
+        """
+
+        len1, len2 = float(len(val1)), float(len(val2))
+
+        if (isinstance(val1, str) and isinstance(val2, str)):
+
+            # Deleting the characters of one string from the other string leaves
+            # the characters that cannot be common
+            #
+            num_common = min(len1 - len(val1.translate(None, val2)),
+                             len2 - len(val2.translate(None, val1)))
+        else:
+            num_common = min(len1, len2)
+
+        if (num_common == 0.0):
+            return 0.0
+
+        return 1./3.*(num_common / len1 + num_common / len2 + 1.0)
+
+    # ---------------------------------------------------------------------------
+
+    def __jaro_python__(self, val1, val2):
+        """Compute the Jaro similarity of two different strings, 0.0 if they have
+           no characters in common. Should not be used from outside the module.
+        """
+
         len1, len2 = len(val1), len(val2)
 
         halflen = max(len1, len2) / 2 - 1
 
-        ass1, ass2 = '', ''  # Characters assigned in string 1 and string 2
+        ass1, ass2 = [], []  # Characters assigned in string 1 and string 2
 
-        workstr1, workstr2 = val1, val2  # Copies of the original strings
+        # The occurrences of a character are assigned in increasing order, so
+        # for each character only the position after its last assigned
+        # occurrence is needed to skip over all assigned occurrences. The window
+        # in which characters are searched moves by one position per character.
+        #
+        next_pos2 = {}  # Positions in string 2 after assigned characters
+
+        find2   = val2.find
+        append1 = ass1.append
 
-        common1, common2 = 0.0, 0.0  # Number of common characters
+        win_start = -halflen
+        win_end   = halflen+1
 
-        for i in range(len1):  # Analyse the first string
-            start = max(0,i-halflen)
-            end   = min(i+halflen+1,len2)
-            index = workstr2.find(val1[i],start,end)
+        for char in val1:  # Analyse the first string
+            start = next_pos2.get(char,0)
+            if (start < win_start):
+                start = win_start
+            index = find2(char,start,win_end)
             if (index > -1):  # Found common character
-                common1 += 1
-                ass1 = ass1 + val1[i]
-                workstr2 = workstr2[:index]+self.JARO_MARKER_CHAR+workstr2[index+1:]
-
-        for i in range(len2):  # Analyse the second string
-            start = max(0,i-halflen)
-            end   = min(i+halflen+1,len1)
-            index = workstr1.find(val2[i],start,end)
+                append1(char)
+                next_pos2[char] = index+1
+            win_start += 1
+            win_end   += 1
+
+        next_pos1 = {}  # Positions in string 1 after assigned characters
+
+        find1   = val1.find
+        append2 = ass2.append
+
+        win_start = -halflen
+        win_end   = halflen+1
+
+        for char in val2:  # Analyse the second string
+            start = next_pos1.get(char,0)
+            if (start < win_start):
+                start = win_start
+            index = find1(char,start,win_end)
             if (index > -1):  # Found common character
-                common2 += 1
-                ass2 = ass2 + val2[i]
-                workstr1 = workstr1[:index]+self.JARO_MARKER_CHAR+workstr1[index+1:]
+                append2(char)
+                next_pos1[char] = index+1
+            win_start += 1
+            win_end   += 1
+
+        common1, common2 = float(len(ass1)), float(len(ass2))  # Number of common
+                                                               # characters
 
         assert (common1 == common2), 'Jaro: Different "common" values'
 
         if (common1 == 0.0):  # No characters in common
-            w = self.disagree_weight
-        else:  # Compute number of transpositions  - - - - - - - - - - - - - - - -
+            return 0.0
 
-            transp = 0.0
-            for i in range(len(ass1)):
-                if (ass1[i] != ass2[i]):
+        # Compute number of transpositions  - - - - - - - - - - - - - - - - - - - -
+        #
+        transp = 0.0
+        if (ass1 != ass2):
+            for (char1, char2) in zip(ass1, ass2):
+                if (char1 != char2):
                     transp += 0.5
 
-            w = 1./3.*(common1 / float(len1) + common1 / float(len2) + (common1-transp) / common1)
-
-            assert (w > 0.0), 'Jaro: Weight is smaller than 0.0: %f' % (w)
+        w = 1./3.*(common1 / float(len1) + common1 / float(len2) + (common1-transp) / common1)
 
-            assert (w < 1.0), 'Jaro: Weight is larger than 1.0: %f' % (w)
+        assert (w > 0.0), 'Jaro: Weight is smaller than 0.0: %f' % (w)
 
-            w = self.__calc_partagree_weight__(val1, val2, w)
-
-        if (self.do_caching == True):  # Put values pair into the cache
-            self.__put_into_cache__(val1, val2, w)
+        assert (w < 1.0), 'Jaro: Weight is larger than 1.0: %f' % (w)
 
         return w
 
@@ -1,10 +1,53 @@
 
 # =============================================================================
 
+import bz2
 import csv
+import gzip
+import io
+import itertools
 import logging
+import marshal
+import mmap
+import os
+import sqlite3
 import string
+import struct
 
+try:  # xz compressed files are only supported if a lzma module is available
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# =============================================================================
+# Layout of binary snapshot files of parsed data sets: a fixed size header with
+# a magic string and the number of records, followed by the marshalled snapshot
+# key and blocks of records, and a final None marker.
+
+SNAPSHOT_MAGIC      = 'DSSNAP01'
+SNAPSHOT_HEADER_FMT = '<8sq'
+SNAPSHOT_BLOCK_SIZE = 10000
+
+# Magic bytes at the start of compressed files
+#
+COMPRESSION_MAGIC_LIST = [('gz',  '\x1f\x8b'),
+                          ('bz2', 'BZh'),
+                          ('xz',  '\xfd7zXZ\x00')]
+
+# Files written by data sets are buffered, and records are passed to the CSV
+# writer in blocks
+#
+WRITE_BUFFER_SIZE = 1 << 20
+WRITE_BLOCK_SIZE  = 10000
+
+# The 'mmap' parser splits files into lines a block of bytes at a time, and
+# projected records are put together from blocks of columns
+#
+READ_BLOCK_SIZE   = 1 << 20
+READ_BATCH_SIZE   = 10000
 
 # =============================================================================
 
@@ -22,6 +65,7 @@ class DataSet:
         self.strip_fields   = True
         self.miss_val       = None
         self.num_records    = None
+        self.proj_col_list  = None  # Columns to read, None means all columns
 
         for (keyword, value) in base_kwargs.items():
 
@@ -66,6 +110,171 @@ class DataSet:
 
   # ---------------------------------------------------------------------------
 
+    def set_projection(self, field_col_list):
+        """Restrict reading of records to the given list of field column numbers.
+
+           Values in all other columns are returned as empty strings and are
+           neither stripped nor checked for missing values, and records read by
+           readall() have one value per field of the data set. Set to None to
+           read all columns again.
+        """
+
+        if (field_col_list == None):
+            self.proj_col_list = None
+            return
+
+        num_fields = len(self.field_list)
+
+        proj_col_list = []
+
+        for field_col in field_col_list:
+            if ((field_col < 0) or (field_col >= num_fields)):
+                logging.exception('Illegal field column number for projection: %s' % \
+                    (str(field_col)))
+                raise Exception
+
+            if (field_col not in proj_col_list):
+                proj_col_list.append(field_col)
+
+        proj_col_list.sort()
+
+        self.proj_col_list = proj_col_list
+
+  # ---------------------------------------------------------------------------
+
+    def __get_read_col_list__(self):
+        """Return the sorted list of columns to be read, including the record
+           identifier column, or None if all columns are to be read. Should not be
+           used from outside the module.
+        """
+
+        if (self.proj_col_list == None):
+            return None
+
+        read_col_list = self.proj_col_list[:]
+
+        if ((self.rec_ident_col != -1) and (self.rec_ident_col not in read_col_list)):
+            read_col_list.append(self.rec_ident_col)
+            read_col_list.sort()
+
+        return read_col_list
+
+  # ---------------------------------------------------------------------------
+
+    def read_batches(self, batch_size):
+        """An iterator which will return blocks of up to 'batch_size' records per
+           call as tuples (first record number, number of records, record
+           identifier list, column list).
+
+           The records of a block are numbered consecutively starting with the
+           first record number (the first record of the data set is number 0).
+           The record identifier list is None if record identifiers are generated
+           from record numbers (as rec_ident+'-%d'). The column list contains one
+           list of values per field of the data set, or None for columns that are
+           not read because of a projection (see set_projection()).
+
+           This default implementation collects the records returned by
+           readall(), derived classes can read blocks more efficiently.
+        """
+
+        if ((not isinstance(batch_size, int)) or (batch_size < 1)):
+            logging.exception('Illegal batch size: %s' % (str(batch_size)))
+            raise Exception
+
+        return self.__read_rec_batches__(batch_size)
+
+  # ---------------------------------------------------------------------------
+
+    def __read_rec_batches__(self, batch_size):
+        """Iterate over blocks of records collected from readall(), with the
+           record identifiers returned by readall(). Should not be used from
+           outside the module.
+        """
+
+        read_col_list = self.__get_read_col_list__()
+
+        first_rec_num = 0
+
+        rec_list = []
+
+        rec_ident_list = []
+
+        for (rec_ident, rec) in self.readall():
+
+            rec_list.append(rec)
+
+            rec_ident_list.append(rec_ident)
+
+            if (len(rec_list) == batch_size):
+                yield self.__make_batch__(first_rec_num, rec_list, read_col_list, False,
+                                          rec_ident_list)
+
+                first_rec_num += batch_size
+
+                rec_list = []
+
+                rec_ident_list = []
+
+        if (rec_list != []):
+            yield self.__make_batch__(first_rec_num, rec_list, read_col_list, False,
+                                      rec_ident_list)
+
+  # ---------------------------------------------------------------------------
+
+    def __make_batch__(self, first_rec_num, row_list, read_col_list, clean_vals,
+                       rec_ident_list = None):
+        """Turn the given list of records (lists of values, possibly of different
+           lengths) into a block of records as returned by read_batches(). If
+           'clean_vals' is True, values are stripped and checked for missing
+           values column by column. If no list of record identifiers is given,
+           they are taken from the record identifier column (or generated). Should
+           not be used from outside the module.
+        """
+
+        num_fields = len(self.field_list)
+
+        if (read_col_list == None):
+            read_col_list = range(num_fields)
+
+        min_num_vals = min(map(len, row_list))
+
+        col_list = [None] * num_fields
+
+        for col in read_col_list:
+
+            if (col < min_num_vals):  # All records have a value in this column
+                col_vals = [row[col] for row in row_list]
+            else:
+                col_vals = [(row[col] if (col < len(row)) else '') for row in row_list]
+
+            if (clean_vals == True):
+                if (self.strip_fields == True):
+                    col_vals = [val.strip() for val in col_vals]
+
+                if (self.miss_val != None):
+                    miss_val_set = set(self.miss_val)
+
+                    col_vals = [('' if val in miss_val_set else val) for val in col_vals]
+
+            col_list[col] = col_vals
+
+        if ((rec_ident_list == None) and (self.rec_ident_col != -1)):
+            rec_ident_list = col_list[self.rec_ident_col][:]
+
+        return (first_rec_num, len(row_list), rec_ident_list, col_list)
+
+  # ---------------------------------------------------------------------------
+
+    def get_chunk_offsets(self, num_chunks):
+        """Split the data set into chunks that can be read independently with
+           read_chunk(). Returns None if the data set cannot be split, which is the
+           default. See implementations in derived classes for details.
+        """
+
+        return None
+
+  # ---------------------------------------------------------------------------
+
 class DataSetCSV(DataSet):
 
     def __init__(self, **kwargs):
@@ -87,6 +296,18 @@ class DataSetCSV(DataSet):
 
         self.rec_ident_col    = -1
 
+        self.lazy_count       = False
+
+        self.parser           = 'csv'  # Or 'mmap' for simple delimited files
+
+        self.mmap             = None
+
+        self.compression      = None  # Set to 'gz', 'bz2' or 'xz' if compressed
+
+        self.snapshot         = False  # Cache parsed records in a binary file
+
+        self.snapshot_file_name = None
+
         # Process all keyword arguments
         #
 
@@ -103,6 +324,18 @@ class DataSetCSV(DataSet):
             elif (keyword.startswith('delimi')):
                 self.delimiter = value
 
+            elif (keyword.startswith('lazy')):
+                self.lazy_count = value
+
+            elif (keyword.startswith('pars')):
+                if (value not in ['csv','mmap']):
+                    logging.exception('Illegal "parser" value: %s' % (str(value)))
+                    raise Exception
+                self.parser = value
+
+            elif (keyword.startswith('snap')):
+                self.snapshot = value
+
             else:
                 base_kwargs[keyword] = value
 
@@ -116,24 +349,44 @@ class DataSetCSV(DataSet):
         if ((self.header_line == True) and (self.access_mode == 'read')):
             self.field_list = []  # Will be generated from file header line
 
+        if (self.access_mode in ['write','append']) and (self.field_list == None):
+            logging.exception('Argument "field_list" must be given for data sets ' + \
+                            'opened for writing')
+            raise Exception
+
 
         if (self.access_mode == 'read'):
 
             try:  # Try to open the file in read mode
-                self.file = open(self.file_name,'r')
+                self.file = self.__open_file__()
             except:
                 logging.exception('Cannot open CSV file "%s" for reading' % (self.file_name))
                 raise IOError
 
-            # Initialise the CSV parser - - - - - - - - - - - - - - - - - - - - - - -
+            # Initialise the CSV parser or the memory map - - - - - - - - - - - - -
+            # (compressed files are read as a stream of lines instead)
             #
+            if ((self.parser == 'mmap') and (self.compression == None)):
+                try:
+                    self.mmap = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+                except ValueError:  # Cannot map an empty file
+                    logging.exception('No records in CSV data set opened for reading')
+                    raise Exception
 
-            self.csv_parser = csv.reader(self.file, delimiter = self.delimiter)
+            else:
+                self.csv_parser = csv.reader(self.file, delimiter = self.delimiter)
 
             # If header line is set to True get field names
             #
             if (self.header_line == True):
-                header_line     = self.csv_parser.next()
+                if (self.parser == 'mmap'):
+                    if (self.mmap != None):
+                        header_line = self.mmap.readline()
+                    else:
+                        header_line = self.file.readline()
+                    header_line = header_line.rstrip('\r\n').split(self.delimiter)
+                else:
+                    header_line = self.csv_parser.next()
 
                 self.field_list = []
 
@@ -145,26 +398,72 @@ class DataSetCSV(DataSet):
                     self.field_list.append((field_name,col_num))
                     col_num += 1
 
-            num_rows = 0
+            # A valid snapshot file already knows the number of records
+            #
+            if (self.snapshot == True):
+                self.snapshot_file_name = self.file_name+'.snap'
+
+                self.num_records = self.__get_snapshot_num_records__()
 
-            fp = open(self.file_name,'r')
+            # Count the number of records, unless this is left to the first full
+            # pass of readall() (lazy count mode, always used for compressed files
+            # to avoid a separate decompression pass)
+            #
+            if ((self.lazy_count == False) and (self.num_records == None) and \
+                (self.compression == None)):
 
-            for l in fp:
-                num_rows += 1
+                num_rows = 0
 
-            fp.close()
+                fp = open(self.file_name,'r')
 
-            self.num_records = num_rows
+                for l in fp:
+                    num_rows += 1
 
-            if (self.header_line == True):
-                self.num_records -= 1
+                fp.close()
+
+                self.num_records = num_rows
+
+                if (self.header_line == True):
+                    self.num_records -= 1
+
+                # Check that there are records in the data set
+                #
+                if (self.num_records == 0):
+                    logging.exception('No records in CSV data set opened for reading')
+                    raise Exception
+
+            self.next_rec_num = 0
 
-            # Check that there are records in the data set
+        elif (self.access_mode in ['write','append']):
+
+            # A header line is only written into new or empty files
             #
-            if (self.num_records == 0):
-                logging.exception('No records in CSV data set opened for reading')
-                raise Exception
+            write_header = ((self.header_line == True) and \
+                            ((self.access_mode == 'write') or \
+                             (not os.path.isfile(self.file_name)) or \
+                             (os.path.getsize(self.file_name) == 0)))
+
+            try:  # Try to open the file in write or append mode
+                if (self.access_mode == 'write'):
+                    self.file = open(self.file_name, 'wb', WRITE_BUFFER_SIZE)
+                else:
+                    self.file = open(self.file_name, 'ab', WRITE_BUFFER_SIZE)
+            except:
+                logging.exception('Cannot open CSV file "%s" for writing' % (self.file_name))
+                raise IOError
+
+            self.csv_writer = csv.writer(self.file, delimiter = self.delimiter,
+                                         lineterminator = '\n')
+
+            if (write_header == True):
+                header_line = []
 
+                for (field_name, field_col) in self.field_list:
+                    header_line.append(field_name)
+
+                self.csv_writer.writerow(header_line)
+
+            self.num_records  = 0  # Number of records written
             self.next_rec_num = 0
 
         else:  # Illegal data set access mode - - - - - - - - - - - - - - - - - - -
@@ -194,7 +493,12 @@ class DataSetCSV(DataSet):
         """An iterator which will return one record per call as a tuple (record
            identifier, record field list).
 
-           The file is first closed and then re-opened returning the first record.
+           The already opened file is rewound to its start, so no new file handle
+           is needed. If the number of records has not been counted yet (lazy
+           count mode), it is set once all records have been read.
+
+           In snapshot mode records are read from a valid snapshot file if there
+           is one, otherwise the first full pass writes the snapshot file.
         """
 
         if (self.file == None):
@@ -205,48 +509,1132 @@ class DataSetCSV(DataSet):
             logging.exception('Data set not initialised for "read" access')
             raise Exception
 
-        self.file.close()
+        read_col_list = self.__get_read_col_list__()
 
-        self.file = open(self.file_name,'r')
+        if (self.snapshot == True):
+            if (self.__get_snapshot_num_records__() != None):
+                return self.__read_snapshot_recs__(read_col_list)
 
-        self.next_rec_num = 0
+            read_col_list = None  # The snapshot has to contain all columns
 
-        # Initialise the CSV parser as reader
-        #
-        self.csv_parser = csv.reader(self.file, delimiter = self.delimiter)
+        if (self.parser == 'mmap'):
+            rec_iter = self.__read_mmap_recs__(read_col_list)
+        else:
+            rec_iter = self.__read_csv_recs__(read_col_list)
+
+        if (self.snapshot == True):
+            return self.__write_snapshot_recs__(rec_iter, self.__get_read_col_list__())
+
+        return rec_iter
+
+  # ---------------------------------------------------------------------------
+
+    def read_batches(self, batch_size):
+        """An iterator which will return blocks of up to 'batch_size' records per
+           call, see DataSet.read_batches() for their format.
+
+           Lines are split and cleaned a block and a column at a time, and no
+           record identifiers are generated. In snapshot mode records are read
+           through readall() instead.
+        """
+
+        if (self.file == None):
+            logging.exception('Data set not initialised')
+            raise Exception
+
+        if (self.access_mode != 'read'):
+            logging.exception('Data set not initialised for "read" access')
+            raise Exception
+
+        if (self.snapshot == True):
+            return DataSet.read_batches(self, batch_size)
+
+        if ((not isinstance(batch_size, int)) or (batch_size < 1)):
+            logging.exception('Illegal batch size: %s' % (str(batch_size)))
+            raise Exception
+
+        return self.__read_line_batches__(self.__get_read_col_list__(), batch_size)
+
+  # ---------------------------------------------------------------------------
+
+    def get_chunk_offsets(self, num_chunks):
+        """Split the records of the file into (at most) the given number of
+           chunks of similar size in bytes, and return a list of tuples (start
+           offset, end offset) with the byte range of each chunk. Chunk borders
+           are aligned on line boundaries, so records must not span several
+           lines.
+
+           Returns None for compressed files, which cannot be split into chunks.
+        """
+
+        if (self.access_mode != 'read'):
+            logging.exception('Data set not initialised for "read" access')
+            raise Exception
+
+        if (self.compression != None):
+            return None
+
+        fp = open(self.file_name,'r')
 
-        # Skip over header (if there is one) and skip to start record
-        #
         if (self.header_line == True):
-            self.csv_parser.next()
+            fp.readline()
 
-        for rec in self.csv_parser:
+        data_start = fp.tell()
 
-            if (self.strip_fields == True):
-                rec = map(string.strip, rec)
+        fp.seek(0, os.SEEK_END)
 
-            if (self.miss_val != None):
-                clean_rec = []
+        data_end = fp.tell()
 
-                miss_val_list = self.miss_val
+        chunk_offset_list = []
 
-                for val in rec:
-                    if (val in miss_val_list):
-                        clean_rec.append('')
-                    else:
-                        clean_rec.append(val)
+        chunk_start = data_start
 
-                rec = clean_rec
+        for chunk_num in range(1, num_chunks+1):
 
-            if (self.rec_ident_col == -1):
-                rec_ident = self.rec_ident+'-%d' % (self.next_rec_num)
+            if (chunk_num == num_chunks):
+                chunk_end = data_end
+
+            else:  # Move approximate chunk end to the start of the next line
+                fp.seek(max(chunk_start, data_start + (data_end - data_start) * \
+                            chunk_num / num_chunks))
+                fp.readline()
+                chunk_end = fp.tell()
+
+            if (chunk_end > chunk_start):
+                chunk_offset_list.append((chunk_start, chunk_end))
+
+            chunk_start = chunk_end
+
+        fp.close()
+
+        return chunk_offset_list
+
+  # ---------------------------------------------------------------------------
+
+    def read_chunk(self, start_offset, end_offset, batch_size = None):
+        """An iterator which will return one record per call as a tuple (record
+           identifier, record field list) for all records in the given byte range
+           as returned by get_chunk_offsets(). If a batch size is given, blocks of
+           records are returned instead as by read_batches().
+
+           The file is opened separately, so chunks can be read independently
+           (e.g. in worker processes). Record identifiers and numbers that are
+           generated start at 0 in each chunk.
+        """
+
+        fp = open(self.file_name,'r')
+
+        fp.seek(start_offset)
+
+        line_list = []
+
+        chunk_len = end_offset - start_offset
+
+        while (chunk_len > 0):
+            line = fp.readline()
+
+            if (line == ''):
+                break
+
+            line_list.append(line)
+
+            chunk_len -= len(line)
+
+        fp.close()
+
+        if (batch_size != None):
+            return self.__read_line_batches__(self.__get_read_col_list__(), batch_size,
+                                              iter(line_list))
+
+        if (self.parser == 'mmap'):
+            return self.__read_mmap_recs__(self.__get_read_col_list__(), iter(line_list))
+        else:
+            return self.__read_csv_recs__(self.__get_read_col_list__(), iter(line_list))
+
+  # ---------------------------------------------------------------------------
+
+    def write(self, rec_iter):
+        """Write the records from the given iterator over record field lists (or
+           any sequence of records) into the file, and return the number of
+           records written. Each record must have a value for every field.
+
+           Records are taken from the iterator and written in blocks, so records
+           can be streamed into the file without keeping them all in memory.
+        """
+
+        if (self.file == None):
+            logging.exception('Data set not initialised')
+            raise Exception
+
+        if (self.access_mode not in ['write','append']):
+            logging.exception('Data set not initialised for "write" or "append" access')
+            raise Exception
+
+        num_fields = len(self.field_list)
+
+        rec_iter = iter(rec_iter)
+
+        num_recs_written = 0
+
+        while (True):
+
+            rec_block = list(itertools.islice(rec_iter, WRITE_BLOCK_SIZE))
+
+            if (rec_block == []):
+                break
+
+            for rec in rec_block:
+                if (len(rec) != num_fields):
+                    logging.exception('Record has %d values, but data set has %d ' % \
+                        (len(rec), num_fields) + 'fields: %s' % (str(rec)))
+                    raise Exception
+
+            self.csv_writer.writerows(rec_block)
+
+            num_recs_written += len(rec_block)
+
+        self.next_rec_num += num_recs_written
+        self.num_records  += num_recs_written
+
+        return num_recs_written
+
+  # ---------------------------------------------------------------------------
 
+    def write_weight_vectors(self, w_vec_iter):
+        """Write the weight vectors from the given iterator over tuples (record
+           identifier 1, record identifier 2, weight vector) into the file, one
+           record pair per line, and return the number of record pairs written.
+
+           Items ((record identifier 1, record identifier 2), weight vector) as
+           returned by iterating over the items of a weight vector dictionary are
+           accepted as well. The data set's field list must contain the two record
+           identifier fields followed by one field per weight.
+        """
+
+        return self.write(self.__get_weight_vector_recs__(w_vec_iter))
+
+  # ---------------------------------------------------------------------------
+
+    def finalise(self):
+        """Close the file, writing all buffered records for data sets opened for
+           writing.
+        """
+
+        if (self.file != None):
+            self.file.close()
+
+        self.file = None
+
+        self.mmap = None
+
+        self.csv_writer = None
+
+  # ---------------------------------------------------------------------------
+
+    def __get_weight_vector_recs__(self, w_vec_iter):
+        """Iterate over the records to be written for the given weight vectors.
+           Should not be used from outside the module.
+        """
+
+        for w_vec_item in w_vec_iter:
+
+            if (len(w_vec_item) == 2):  # Item of a weight vector dictionary
+                ((rec_ident1, rec_ident2), w_vec) = w_vec_item
             else:
-                rec_ident = rec[self.rec_ident_col]
+                (rec_ident1, rec_ident2, w_vec) = w_vec_item
 
-            self.next_rec_num += 1
+            yield [rec_ident1, rec_ident2] + list(w_vec)
 
-            yield (rec_ident,rec)
+  # ---------------------------------------------------------------------------
+
+    def __open_file__(self):
+        """Open the file for reading. Compressed files (detected from their first
+           bytes) are opened for streaming decompression. Should not be used from
+           outside the module.
+        """
 
+        fp = open(self.file_name,'rb')
 
-# =============================================================================
+        file_start = fp.read(8)
+
+        fp.close()
+
+        self.compression = None
+
+        for (compression, magic) in COMPRESSION_MAGIC_LIST:
+            if (file_start.startswith(magic)):
+                self.compression = compression
+                break
+
+        if (self.compression == 'gz'):  # Buffered for fast reading of lines
+            return io.BufferedReader(gzip.GzipFile(self.file_name,'rb'), 1 << 16)
+
+        elif (self.compression == 'bz2'):
+            return bz2.BZ2File(self.file_name,'r')
+
+        elif (self.compression == 'xz'):
+            if (lzma == None):
+                logging.exception('Cannot read xz compressed file "%s", no lzma module ' % \
+                    (self.file_name) + 'available')
+                raise Exception
+
+            return lzma.LZMAFile(self.file_name,'r')
+
+        return open(self.file_name,'r')
+
+  # ---------------------------------------------------------------------------
+
+    def __getstate__(self):
+        """Return the attributes to be pickled (for example when sending the data
+           set to worker processes), without open file handles and parsers.
+        """
+
+        state = self.__dict__.copy()
+
+        for attr_name in ['file', 'mmap', 'csv_parser', 'csv_writer']:
+            if (attr_name in state):
+                state[attr_name] = None
+
+        return state
+
+  # ---------------------------------------------------------------------------
+
+    def __read_csv_recs__(self, proj_col_list, line_iter = None):
+        """Iterate over all records using the Python csv module, or only over
+           the records in the given iterator over lines of the file. Should not
+           be used from outside the module.
+        """
+
+        self.next_rec_num = 0
+
+        reads_all = (line_iter == None)
+
+        if (reads_all == True):  # Read the whole file
+            self.file.seek(0)
+
+            # Initialise the CSV parser as reader
+            #
+            self.csv_parser = csv.reader(self.file, delimiter = self.delimiter)
+
+            # Skip over header (if there is one) and skip to start record
+            #
+            if (self.header_line == True):
+                self.csv_parser.next()
+
+        else:
+            self.csv_parser = csv.reader(line_iter, delimiter = self.delimiter)
+
+        num_fields = len(self.field_list)
+
+        for rec in self.csv_parser:
+
+            if (proj_col_list != None):  # Only clean the projected columns
+                num_vals = len(rec)
+
+                proj_rec = [''] * num_fields
+
+                for col in proj_col_list:
+                    if (col < num_vals):
+                        val = rec[col]
+
+                        if (self.strip_fields == True):
+                            val = val.strip()
+
+                        if ((self.miss_val != None) and (val in self.miss_val)):
+                            val = ''
+
+                        proj_rec[col] = val
+
+                rec = proj_rec
+
+            else:
+
+                if (self.strip_fields == True):
+                    rec = map(string.strip, rec)
+
+                if (self.miss_val != None):
+                    clean_rec = []
+
+                    miss_val_list = self.miss_val
+
+                    for val in rec:
+                        if (val in miss_val_list):
+                            clean_rec.append('')
+                        else:
+                            clean_rec.append(val)
+
+                    rec = clean_rec
+
+            if (self.rec_ident_col == -1):
+                rec_ident = self.rec_ident+'-%d' % (self.next_rec_num)
+
+            else:
+                rec_ident = rec[self.rec_ident_col]
+
+            self.next_rec_num += 1
+
+            yield (rec_ident,rec)
+
+        if (reads_all == True):
+            self.__set_lazy_num_records__()
+
+  # ---------------------------------------------------------------------------
+
+    def __read_mmap_recs__(self, proj_col_list, line_iter = None):
+        """Iterate over all records by splitting lines and fields directly from
+           the memory mapped file (or from the lines in the given iterator). Only
+           valid for simple delimited files where values contain neither quotes,
+           delimiters nor line breaks. Should not be used from outside the
+           module.
+
+           Projected records are put together from blocks of columns as returned
+           by __read_line_batches__(), so only the projected columns are split
+           and cleaned.
+        """
+
+        rec_ident_col = self.rec_ident_col
+        rec_ident_fmt = str(self.rec_ident)+'-%d'
+
+        if (proj_col_list != None):
+
+            for (first_rec_num, num_recs, rec_ident_list, col_list) in \
+                self.__read_line_batches__(proj_col_list, READ_BATCH_SIZE, line_iter):
+
+                empty_col = [''] * num_recs
+
+                for col in range(len(col_list)):
+                    if (col_list[col] == None):
+                        col_list[col] = empty_col
+
+                if (rec_ident_list == None):
+                    rec_ident_list = [rec_ident_fmt % (rec_num) for rec_num in \
+                                      xrange(first_rec_num, first_rec_num+num_recs)]
+
+                for rec_item in itertools.izip(rec_ident_list,
+                                               itertools.imap(list, itertools.izip(*col_list))):
+                    yield rec_item
+
+            return
+
+        self.next_rec_num = 0
+
+        delimiter = self.delimiter
+
+        if (self.miss_val != None):
+            miss_val_set = set(self.miss_val)
+        else:
+            miss_val_set = None
+
+        for line_list in self.__read_line_blocks__(line_iter):
+
+            if (self.strip_fields == True):
+                rec_list = [map(str.strip, line.split(delimiter)) for line in line_list]
+            else:
+                rec_list = [line.split(delimiter) for line in line_list]
+
+            if ('' in line_list):  # Same as the csv module for empty lines
+                rec_list = [(rec if (line != '') else []) for (line, rec) in \
+                            itertools.izip(line_list, rec_list)]
+
+            if (miss_val_set != None):
+                rec_list = [[('' if val in miss_val_set else val) for val in rec] \
+                            for rec in rec_list]
+
+            first_rec_num = self.next_rec_num
+
+            self.next_rec_num += len(rec_list)
+
+            if (rec_ident_col == -1):
+                rec_ident_list = [rec_ident_fmt % (rec_num) for rec_num in \
+                                  xrange(first_rec_num, self.next_rec_num)]
+            else:
+                rec_ident_list = [rec[rec_ident_col] for rec in rec_list]
+
+            for rec_item in itertools.izip(rec_ident_list, rec_list):
+                yield rec_item
+
+        if (line_iter == None):
+            self.__set_lazy_num_records__()
+
+  # ---------------------------------------------------------------------------
+
+    def __read_line_batches__(self, proj_col_list, batch_size, line_iter = None):
+        """Iterate over blocks of all records, or of the records in the given
+           iterator over lines of the file. Lines are split with the Python csv
+           module or, for the 'mmap' parser, directly with string splits. Should
+           not be used from outside the module.
+        """
+
+        self.next_rec_num = 0
+
+        reads_all = (line_iter == None)
+
+        if (self.parser == 'mmap'):
+            line_iter = itertools.chain.from_iterable(self.__read_line_blocks__(line_iter))
+
+            delimiter = self.delimiter
+
+            if (proj_col_list != None):  # No need to split beyond the last column
+                max_split = proj_col_list[-1]+1
+            else:
+                max_split = -1
+
+        else:
+            if (reads_all == True):  # Read the whole file
+                self.file.seek(0)
+
+                if (self.header_line == True):
+                    self.file.readline()
+
+                line_iter = iter(self.file.readline, '')
+
+            row_iter = csv.reader(line_iter, delimiter = self.delimiter)
+
+        while (True):
+
+            if (self.parser == 'mmap'):
+                row_list = [line.split(delimiter, max_split) for line in \
+                            itertools.islice(line_iter, batch_size)]
+            else:
+                row_list = list(itertools.islice(row_iter, batch_size))
+
+            if (row_list == []):
+                break
+
+            batch = self.__make_batch__(self.next_rec_num, row_list, proj_col_list,
+                                        True)
+
+            self.next_rec_num += len(row_list)
+
+            yield batch
+
+        if (reads_all == True):
+            self.__set_lazy_num_records__()
+
+  # ---------------------------------------------------------------------------
+
+    def __read_line_blocks__(self, line_iter = None):
+        """Iterate over lists of the lines (without line breaks) of all records
+           of the file, or return the lines in the given iterator over lines of
+           the file as one list. The memory mapped file (or the decompressed
+           stream of a compressed file) is split into lines a block of bytes at a
+           time. Should not be used from outside the module.
+        """
+
+        if (line_iter != None):
+            yield [line.rstrip('\r\n') for line in line_iter]
+            return
+
+        if (self.mmap != None):
+            self.mmap.seek(0)
+
+            if (self.header_line == True):
+                self.mmap.readline()
+
+            block_start = self.mmap.tell()
+
+            file_size = self.mmap.size()
+
+            while (block_start < file_size):
+                block_end = block_start + READ_BLOCK_SIZE
+
+                if (block_end < file_size):  # End the block after its last line
+                    line_end = self.mmap.rfind('\n', block_start, block_end)
+
+                    if (line_end == -1):  # Line longer than the block size
+                        line_end = self.mmap.find('\n', block_end)
+
+                    if (line_end == -1):
+                        block_end = file_size
+                    else:
+                        block_end = line_end+1
+
+                yield self.__split_lines__(self.mmap[block_start:block_end])
+
+                block_start = block_end
+
+        else:  # Compressed file, read blocks of the decompressed stream
+            self.file.seek(0)
+
+            if (self.header_line == True):
+                self.file.readline()
+
+            rest_str = ''  # Incomplete last line of the previous block
+
+            while (True):
+                block_str = self.file.read(READ_BLOCK_SIZE)
+
+                if (block_str == ''):
+                    break
+
+                line_end = block_str.rfind('\n')
+
+                if (line_end == -1):
+                    rest_str += block_str
+
+                else:
+                    yield self.__split_lines__(rest_str + block_str[:line_end+1])
+
+                    rest_str = block_str[line_end+1:]
+
+            if (rest_str != ''):
+                yield self.__split_lines__(rest_str)
+
+  # ---------------------------------------------------------------------------
+
+    def __split_lines__(self, block_str):
+        """Split the given string into lines without line breaks. Should not be
+           used from outside the module.
+        """
+
+        line_list = block_str.split('\n')
+
+        if (line_list[-1] == ''):  # Nothing follows the last line break
+            line_list.pop()
+
+        if ('\r' in block_str):
+            line_list = [line.rstrip('\r') for line in line_list]
+
+        return line_list
+
+  # ---------------------------------------------------------------------------
+
+    def __get_snapshot_key__(self):
+        """Return the key a snapshot file must match to be valid for this data
+           set: the source file path, size and modification time, and all
+           options that influence how records are parsed. Should not be used from
+           outside the module.
+        """
+
+        file_stat = os.stat(self.file_name)
+
+        return (os.path.abspath(self.file_name), file_stat.st_size,
+                file_stat.st_mtime, self.parser, self.delimiter,
+                self.header_line, self.strip_fields, self.miss_val,
+                self.rec_ident)
+
+  # ---------------------------------------------------------------------------
+
+    def __get_snapshot_num_records__(self):
+        """Return the number of records in the snapshot file, or None if there is
+           no snapshot file or it does not match the current source file and
+           options. Should not be used from outside the module.
+        """
+
+        header_len = struct.calcsize(SNAPSHOT_HEADER_FMT)
+
+        try:
+            snap_file = open(self.snapshot_file_name, 'rb')
+        except IOError:
+            return None
+
+        try:
+            (magic, num_records) = struct.unpack(SNAPSHOT_HEADER_FMT,
+                                                 snap_file.read(header_len))
+            snap_key = marshal.load(snap_file)
+        except (struct.error, EOFError, ValueError, TypeError):
+            snap_file.close()
+            return None
+
+        snap_file.close()
+
+        if ((magic != SNAPSHOT_MAGIC) or (num_records < 0) or \
+            (snap_key != self.__get_snapshot_key__())):
+            return None
+
+        return num_records
+
+  # ---------------------------------------------------------------------------
+
+    def __read_snapshot_recs__(self, proj_col_list):
+        """Iterate over all records stored in the snapshot file. Blocks of records
+           are stored column-wise if all their records have the same number of
+           fields, otherwise record-wise. Should not be used from outside the
+           module.
+        """
+
+        snap_file = open(self.snapshot_file_name, 'rb')
+
+        snap_file.seek(struct.calcsize(SNAPSHOT_HEADER_FMT))
+
+        marshal.load(snap_file)  # Skip over the snapshot key
+
+        self.next_rec_num = 0
+
+        rec_ident_col = self.rec_ident_col
+        rec_ident_fmt = str(self.rec_ident)+'-%d'
+
+        block = marshal.load(snap_file)
+
+        while (block != None):
+
+            (block_type, block_data) = block
+
+            if (block_type == 'c'):  # Columns, all of the same length
+                if (proj_col_list != None):
+                    empty_col = [''] * len(block_data[0])
+
+                    for col in range(len(block_data)):
+                        if (col not in proj_col_list):
+                            block_data[col] = empty_col
+
+                block_rec_list = map(list, zip(*block_data))
+
+            else:  # Records of different lengths
+                block_rec_list = block_data
+
+                if (proj_col_list != None):
+                    block_rec_list = [self.__project_rec__(rec, proj_col_list) \
+                                      for rec in block_rec_list]
+
+            for rec in block_rec_list:
+
+                if (rec_ident_col == -1):
+                    rec_ident = rec_ident_fmt % (self.next_rec_num)
+
+                else:
+                    rec_ident = rec[rec_ident_col]
+
+                self.next_rec_num += 1
+
+                yield (rec_ident,rec)
+
+            block = marshal.load(snap_file)
+
+        snap_file.close()
+
+  # ---------------------------------------------------------------------------
+
+    def __write_snapshot_recs__(self, rec_iter, proj_col_list):
+        """Pass on all records from the given record iterator while writing them
+           into a new snapshot file. The snapshot file is only put into place once
+           all records have been read, otherwise the temporary file is removed.
+           If the snapshot file cannot be created the records are passed on
+           without writing them. Should not be used from outside the module.
+        """
+
+        tmp_file_name = self.snapshot_file_name+'.tmp'
+
+        try:
+            snap_file = open(tmp_file_name, 'wb')
+
+        except (IOError, OSError):
+            logging.warning('Cannot create snapshot file "%s", reading records ' % \
+                            (tmp_file_name) + 'without a snapshot')
+
+            for (rec_ident, rec) in rec_iter:
+
+                if (proj_col_list != None):
+                    rec = self.__project_rec__(rec, proj_col_list)
+
+                yield (rec_ident,rec)
+
+            return
+
+        block_rec_list = []
+
+        try:
+            snap_file.write(struct.pack(SNAPSHOT_HEADER_FMT, SNAPSHOT_MAGIC, -1))
+
+            marshal.dump(self.__get_snapshot_key__(), snap_file)
+
+            for (rec_ident, rec) in rec_iter:
+
+                block_rec_list.append(rec)
+
+                if (len(block_rec_list) == SNAPSHOT_BLOCK_SIZE):
+                    self.__dump_snapshot_block__(snap_file, block_rec_list)
+                    block_rec_list = []
+
+                if (proj_col_list != None):
+                    rec = self.__project_rec__(rec, proj_col_list)
+
+                yield (rec_ident,rec)
+
+            if (block_rec_list != []):
+                self.__dump_snapshot_block__(snap_file, block_rec_list)
+
+            marshal.dump(None, snap_file)  # End of records marker
+
+            snap_file.seek(0)
+            snap_file.write(struct.pack(SNAPSHOT_HEADER_FMT, SNAPSHOT_MAGIC,
+                                        self.next_rec_num))
+            snap_file.close()
+
+            os.rename(tmp_file_name, self.snapshot_file_name)
+
+        except BaseException:  # Not all records were read or written, discard
+            snap_file.close()  # the snapshot (also when the generator is closed)
+
+            if (os.path.exists(tmp_file_name)):
+                os.remove(tmp_file_name)
+            raise
+
+  # ---------------------------------------------------------------------------
+
+    def __dump_snapshot_block__(self, snap_file, block_rec_list):
+        """Write one block of records into the snapshot file. Should not be used
+           from outside the module.
+        """
+
+        num_fields = len(block_rec_list[0])
+
+        is_rectangular = (num_fields > 0)
+
+        for rec in block_rec_list:
+            if (len(rec) != num_fields):
+                is_rectangular = False
+                break
+
+        if (is_rectangular == True):
+            marshal.dump(('c', map(list, zip(*block_rec_list))), snap_file)
+        else:
+            marshal.dump(('r', block_rec_list), snap_file)
+
+  # ---------------------------------------------------------------------------
+
+    def __project_rec__(self, rec, proj_col_list):
+        """Return a record with one value per field of the data set, with the
+           values of the projected columns copied from the given record and all
+           other values set to empty strings. Should not be used from outside the
+           module.
+        """
+
+        num_vals = len(rec)
+
+        proj_rec = [''] * len(self.field_list)
+
+        for col in proj_col_list:
+            if (col < num_vals):
+                proj_rec[col] = rec[col]
+
+        return proj_rec
+
+  # ---------------------------------------------------------------------------
+
+    def __set_lazy_num_records__(self):
+        """Set the number of records after a complete pass over the file if they
+           were not counted when the data set was initialised (lazy count mode).
+           Should not be used from outside the module.
+        """
+
+        if (self.num_records == None):
+            self.num_records = self.next_rec_num
+
+            if (self.num_records == 0):
+                logging.exception('No records in CSV data set opened for reading')
+                raise Exception
+
+# =============================================================================
+
+class DataSetSQLite(DataSet):
+    """Data set based on a table in a SQLite database file (accessed with the
+       Python standard module sqlite3).
+
+       Records are read in batches of 'batch_size' rows. If the record
+       identifier is not a field of the table, record identifiers are generated
+       from the SQLite rowid of each record (counting from 0, as for CSV data
+       sets), so records can also be fetched by their identifier with
+       readrecord() and readrecords().
+
+       Note that the indexing classes do not use readrecords() yet: they still
+       read all records into a RecordStore, so comparing record pairs is not
+       done out-of-core for SQLite data sets either.
+    """
+
+    def __init__(self, **kwargs):
+        """Constructor. Process the derived attributes first, then call the base
+         class constructor.
+        """
+
+        self.dataset_type     = 'SQLite'
+
+        self.file_name        = None
+
+        self.table_name       = None
+
+        self.batch_size       = 10000
+
+        self.db_conn          = None
+
+        self.next_rec_num     = None
+
+        self.rec_ident_col    = -1
+
+        # Process all keyword arguments
+        #
+
+        base_kwargs = {}  # Dictionary, will contain unprocessed arguments
+
+        for (keyword, value) in kwargs.items():
+
+            if (keyword.startswith('file')):
+                self.file_name = value
+
+            elif (keyword.startswith('table')):
+                self.table_name = value
+
+            elif (keyword.startswith('batch')):
+                if ((not isinstance(value, int)) or (value < 1)):
+                    logging.exception('Illegal "batch_size" value: %s' % (str(value)))
+                    raise Exception
+                self.batch_size = value
+
+            else:
+                base_kwargs[keyword] = value
+
+        DataSet.__init__(self, base_kwargs)  # Process base arguments
+
+        if (self.table_name == None):
+            logging.exception('Argument "table_name" must be given')
+            raise Exception
+
+        if (self.access_mode == 'read'):
+
+            # Connecting would create a new empty database if the file is missing
+            #
+            if (not os.path.isfile(self.file_name)):
+                logging.exception('Cannot open SQLite database "%s" for reading' % \
+                    (self.file_name))
+                raise IOError
+
+            self.db_conn = sqlite3.connect(self.file_name)
+
+            self.db_conn.text_factory = str  # Return byte strings, as for CSV
+
+            table_info = self.db_conn.execute('PRAGMA table_info(%s)' % \
+                                              (self.__quote_name__(self.table_name))).fetchall()
+
+            if (table_info == []):
+                logging.exception('No table "%s" in SQLite database "%s"' % \
+                    (self.table_name, self.file_name))
+                raise Exception
+
+            table_col_names = []
+
+            for col_info in table_info:
+                table_col_names.append(col_info[1])
+
+            if (self.field_list == None):  # Take field names from the table
+                self.field_list = []
+
+                col_num = 0
+
+                for col_name in table_col_names:
+                    self.field_list.append((col_name,col_num))
+                    col_num += 1
+
+            else:
+                for (field_name, field_col) in self.field_list:
+                    if (field_name not in table_col_names):
+                        logging.exception('Field "%s" is not a column of table "%s"' % \
+                            (field_name, self.table_name))
+                        raise Exception
+
+            # Counting rows is cheap in SQLite, no need to read the records
+            #
+            self.num_records = self.db_conn.execute('SELECT COUNT(*) FROM %s' % \
+                                   (self.__quote_name__(self.table_name))).fetchone()[0]
+
+            if (self.num_records == 0):
+                logging.exception('No records in SQLite data set opened for reading')
+                raise Exception
+
+            self.next_rec_num = 0
+
+        else:  # Illegal data set access mode - - - - - - - - - - - - - - - - - - -
+
+            logging.exception('Illegal data set access mode: "%s" (not currently allowed / supported ' % \
+                (str(self.access_mode)) + 'with SQLite data set implementation).')
+            raise Exception
+
+        this_col_num = 0  # Check if column numbers are consecutive
+
+        for (field_name, field_col) in self.field_list:
+
+            if (this_col_num != field_col):
+                logging.exception('Column numbers are not consecutive: %s' % (str(self.field_list)))
+                raise Exception
+            else:
+                this_col_num += 1
+
+            # Check if this is the record identifier field
+            #
+            if (self.rec_ident == field_name):
+                self.rec_ident_col = field_col
+
+  # ---------------------------------------------------------------------------
+
+    def readall(self):
+        """An iterator which will return one record per call as a tuple (record
+           identifier, record field list), in the order of the table rows.
+        """
+
+        self.__check_read_access__()
+
+        return self.__read_rows__('', ())
+
+  # ---------------------------------------------------------------------------
+
+    def readrecord(self, rec_ident):
+        """Return the field list of the record with the given identifier, or None
+           if there is no such record.
+        """
+
+        rec_dict = self.readrecords([rec_ident])
+
+        return rec_dict.get(rec_ident)
+
+  # ---------------------------------------------------------------------------
+
+    def readrecords(self, rec_ident_list):
+        """Return a dictionary with the field lists of the records with the given
+           identifiers. Identifiers of records that do not exist are not included.
+
+           This allows fetching only the records of a batch of candidate record
+           pairs, but the indexing classes are not using it yet.
+        """
+
+        self.__check_read_access__()
+
+        rec_dict = {}
+
+        if (self.rec_ident_col == -1):  # Record identifiers are based on rowids
+            rowid_prefix = str(self.rec_ident)+'-'
+
+            key_list = []
+
+            for rec_ident in rec_ident_list:
+                if (rec_ident.startswith(rowid_prefix) and \
+                    rec_ident[len(rowid_prefix):].isdigit()):
+                    key_list.append(int(rec_ident[len(rowid_prefix):])+1)
+
+            key_col_name = 'rowid'
+
+        else:
+            key_list = list(rec_ident_list)
+
+            key_col_name = self.__quote_name__(self.field_list[self.rec_ident_col][0])
+
+        # Look up records in batches, SQLite limits the number of parameters
+        #
+        for i in range(0, len(key_list), 500):
+            key_batch = key_list[i:i+500]
+
+            where_clause = ' WHERE %s IN (%s)' % (key_col_name,
+                                                  ','.join(['?'] * len(key_batch)))
+
+            for (rec_ident, rec) in self.__read_rows__(where_clause, key_batch):
+                rec_dict[rec_ident] = rec
+
+        return rec_dict
+
+  # ---------------------------------------------------------------------------
+
+    def finalise(self):
+        """Close the database connection.
+        """
+
+        if (self.db_conn != None):
+            self.db_conn.close()
+
+        self.db_conn = None
+
+  # ---------------------------------------------------------------------------
+
+    def __read_rows__(self, where_clause, param_list):
+        """Iterate over the records selected by the given SQL where clause,
+           fetching rows in batches and only the columns to be read. Should not be
+           used from outside the module.
+        """
+
+        num_fields = len(self.field_list)
+
+        read_col_list = self.__get_read_col_list__()
+
+        if (read_col_list == None):
+            read_col_list = range(num_fields)
+
+        col_name_list = ['rowid']
+
+        for field_col in read_col_list:
+            col_name_list.append(self.__quote_name__(self.field_list[field_col][0]))
+
+        sql_str = 'SELECT %s FROM %s%s ORDER BY rowid' % (', '.join(col_name_list),
+                  self.__quote_name__(self.table_name), where_clause)
+
+        cursor = self.db_conn.cursor()
+
+        cursor.execute(sql_str, param_list)
+
+        strip_fields  = self.strip_fields
+        miss_val_list = self.miss_val
+        rec_ident_col = self.rec_ident_col
+        rec_ident_fmt = str(self.rec_ident)+'-%d'
+
+        read_col_pos_list = zip(range(1, len(read_col_list)+1), read_col_list)
+
+        self.next_rec_num = 0
+
+        row_list = cursor.fetchmany(self.batch_size)
+
+        while (row_list != []):
+
+            for row in row_list:
+
+                rec = [''] * num_fields
+
+                for (row_pos, field_col) in read_col_pos_list:
+                    val = row[row_pos]
+
+                    if (val == None):  # SQL NULL
+                        continue
+
+                    if (not isinstance(val, str)):  # Numbers
+                        val = str(val)
+
+                    if (strip_fields == True):
+                        val = val.strip()
+
+                    if ((miss_val_list != None) and (val in miss_val_list)):
+                        val = ''
+
+                    rec[field_col] = val
+
+                if (rec_ident_col == -1):
+                    rec_ident = rec_ident_fmt % (row[0]-1)  # Rowids start at 1
+
+                else:
+                    rec_ident = rec[rec_ident_col]
+
+                self.next_rec_num += 1
+
+                yield (rec_ident,rec)
+
+            row_list = cursor.fetchmany(self.batch_size)
+
+        cursor.close()
+
+  # ---------------------------------------------------------------------------
+
+    def __check_read_access__(self):
+        """Check that the data set is opened for reading. Should not be used from
+           outside the module.
+        """
+
+        if (self.db_conn == None):
+            logging.exception('Data set not initialised')
+            raise Exception
+
+        if (self.access_mode != 'read'):
+            logging.exception('Data set not initialised for "read" access')
+            raise Exception
+
+  # ---------------------------------------------------------------------------
+
+    def __quote_name__(self, name):
+        """Quote a table or column name for use in SQL statements. Should not be
+           used from outside the module.
+        """
+
+        return '"%s"' % (name.replace('"','""'))
@@ -5,8 +5,23 @@ Encoding methods provided:
 
   nysiis          NYSIIS
 
+  soundex         Soundex
+
+  metaphone       Metaphone style code, based on the main rules of (Double)
+                  Metaphone
+
+  sorted_qgram_prefix  Key made of the alphabetically first q-grams
+
   get_substring   Simple function which extracts and returns a sub-string
 
+Whole columns of values can be encoded with encode_column(), which encodes
+each distinct value only once.
+
+Encoded values can be cached with the class CachedEncoder, which wraps any of
+the encoding functions, for example cached_nysiis. It keeps the codes in a
+LRUCache, a bounded cache of the most recently used values that is also used
+by the field comparators.
+
 Note that all encoding routines assume the input string only contains letters
 and whitespaces, but not digits or other ASCII characters.
 """
@@ -15,13 +30,43 @@ and whitespaces, but not digits or other ASCII characters.
 # Imports go here
 
 import logging
+import re
 import string
 import time
 
+# =============================================================================
+# Precomputed tables for NYSIIS encoding
+
+NYSIIS_SUFFIX_DICT = {'ix':'ic', 'ex':'ec', 'ye':'y', 'ee':'y', 'ie':'y',
+                      'dt':'d', 'rt':'d', 'rd':'d', 'nt':'n', 'nd':'n'}
+
+NYSIIS_VOWEL_TABLE = string.maketrans('eiou', 'aaaa')
+NYSIIS_MQ_TABLE    = string.maketrans('mq', 'ng')
+NYSIIS_YZ_TABLE    = string.maketrans('yz', 'as')
+
+# =============================================================================
+# Precomputed tables for Soundex and Metaphone encoding
+
+SOUNDEX_TABLE = string.maketrans('abcdefgijklmnopqrstuvxyz',
+                                 '012301202245501262301202')  # H and W deleted
+
+METAPHONE_INITIAL_DICT = {'ae':'e', 'gn':'n', 'kn':'n', 'pn':'n', 'wr':'r',
+                          'wh':'w', 'x':'s'}
+
+# Codes of letters that do not depend on their neighbours
+#
+METAPHONE_CODE_DICT = {'f':'f', 'j':'j', 'l':'l', 'm':'m', 'n':'n', 'q':'k',
+                       'r':'r', 'v':'f', 'x':'ks', 'z':'s'}
+
+REPEAT_CHAR_REGEX = re.compile(r'(.)\1', re.DOTALL)  # Repeated characters
+
 # =============================================================================
 
 def nysiis(s, maxlen=4):
     """Compute the NYSIIS code for a string.
+
+       The translation tables are precomputed in the module, and only the
+       replacements whose patterns can occur in the string are applied.
     """
 
     if (not s):
@@ -29,28 +74,30 @@ def nysiis(s, maxlen=4):
 
     # Remove trailing S or Z
     #
-    while s and s[-1] in 'sz':
-        s = s[:-1]
+    s = s.rstrip('sz')
+
+    if (not s):
+        return ''
 
     # Translate first characters of string
     #
-    if (s[:3] == 'mac'):  # Initial 'MAC' -> 'MC'
+    first = s[0]
+
+    if ((first == 'm') and (s[:3] == 'mac')):  # Initial 'MAC' -> 'MC'
         s = 'mc'+s[3:]
-    elif (s[:2] == 'pf'):  # Initial 'PF' -> 'F'
+    elif ((first == 'p') and (s[:2] == 'pf')):  # Initial 'PF' -> 'F'
         s = s[1:]
 
     # Translate some suffix characters:
     #
-    suff_dict = {'ix':'ic', 'ex':'ec', 'ye':'y', 'ee':'y', 'ie':'y', 'dt':'d', 'rt':'d', 'rd':'d', 'nt':'n', 'nd':'n'}
-
     suff = s[-2:]
 
-    s = s[:-2]+suff_dict.get(suff, suff)
+    if (suff in NYSIIS_SUFFIX_DICT):
+        s = s[:-2]+NYSIIS_SUFFIX_DICT[suff]
 
     # Replace EV with EF
     #
-
-    if (s[2:].find('ev') > -1):
+    if ('ev' in s[2:]):
         s = s[:-2]+s[2:].replace('ev','ef')
 
     if (not s):
@@ -60,58 +107,61 @@ def nysiis(s, maxlen=4):
 
     # Replace all vowels with A and delete whitespaces
     #
-    voweltable = string.maketrans('eiou', 'aaaa')
-
-    s2 = string.translate(s,voweltable, ' ')
+    s2 = s.translate(NYSIIS_VOWEL_TABLE, ' ')
 
     if (not s2):  # String only contained whitespaces
         return ''
 
     # Remove all W that follow an A
     #
-    s2 = s2.replace('aw','a')
+    if ('w' in s2):
+        s2 = s2.replace('aw','a')
 
     # Various replacement patterns
     #
-    s2 = s2.replace('ght','gt')
-    s2 = s2.replace('dg','g')
-    s2 = s2.replace('ph','f')
-    s2 = s2[0]+s2[1:].replace('ah','a')
-    s3 = s2[0]+s2[1:].replace('ha','a')
-    s3 = s3.replace('kn','n')
-    s3 = s3.replace('k','c')
-    s4 = s3[0]+s3[1:].replace('m','n')
-    s5 = s4[0]+s4[1:].replace('q','g')
-    s5 = s5.replace('sh','s')
-    s5 = s5.replace('sch','s')
-    s5 = s5.replace('yw','y')
-    s5 = s5.replace('wr','r')
-
-    # If not first or last, replace Y with A
-    #
-    s6 = s5[0]+s5[1:-1].replace('y','a')+s5[-1]
+    if ('h' in s2):
+        s2 = s2.replace('ght','gt')
+        s2 = s2.replace('dg','g')
+        s2 = s2.replace('ph','f')
+        s2 = s2[0]+s2[1:].replace('ah','a')
+        s3 = s2[0]+s2[1:].replace('ha','a')
+    else:
+        s2 = s2.replace('dg','g')
+        s3 = s2
+
+    if ('k' in s3):
+        s3 = s3.replace('kn','n')
+        s3 = s3.replace('k','c')
+
+    s5 = s3[0]+s3[1:].translate(NYSIIS_MQ_TABLE)
+
+    if ('h' in s5):
+        s5 = s5.replace('sh','s')
+        s5 = s5.replace('sch','s')
+
+    if ('w' in s5):
+        s5 = s5.replace('yw','y')
+        s5 = s5.replace('wr','r')
 
-    # If not first character, replace Z with S
+    # If not first or last, replace Y with A, and if not first character,
+    # replace Z with S (a single character is both first and last, so it is
+    # doubled here)
     #
-    s7 = s6[0]+s6[1:].replace('z','s')
+    if (('y' in s5) or ('z' in s5) or (len(s5) == 1)):
+        s7 = s5[0]+s5[1:-1].translate(NYSIIS_YZ_TABLE)+s5[-1].replace('z','s')
+    else:
+        s7 = s5
 
     # Replace trailing AY with Y
     #
     if (s7[-2:] == 'ay'):
         s7 = s7[:-2]+'y'
 
-    # Remove trailing vowels (now only A)
+    # Remove trailing vowels (now only A), and collapse repeated characters
     #
-    while s7 and s7[-1] == 'a':
-        s7 = s7[:-1]
+    s7 = s7.rstrip('a')
 
-    if (len(s7) == 0):
-        resstr = ''
-    else:
-        resstr = s7[0]
-        for i in s7[1:]:
-            if (i != resstr[-1]):
-                resstr=resstr+i
+    resstr = collapse_repeats(s7)
 
     # Now compile final result string
     #
@@ -125,6 +175,209 @@ def nysiis(s, maxlen=4):
 
 # =============================================================================
 
+def soundex(s, maxlen=4):
+    """Compute the Soundex code for a string.
+
+       The first letter is kept, all following letters are replaced by digits
+       (vowels and Y by 0, H and W are removed), repeated digits are collapsed
+       and zeros removed. Codes are padded with zeros to 'maxlen' characters.
+    """
+
+    s = ''.join(s.split())  # Remove whitespaces
+
+    if (not s):
+        return ''
+
+    first = s[0]
+
+    digits = collapse_repeats(s.translate(SOUNDEX_TABLE, 'hw'))
+
+    if (first not in 'hw'):  # Code of the first letter is not used
+        digits = digits[1:]
+
+    resstr = first+digits.replace('0','')
+
+    if (maxlen > 0):
+        resstr = (resstr+'0'*maxlen)[:maxlen]  # Pad with zeros and truncate
+
+    return resstr
+
+# =============================================================================
+
+def metaphone(s, maxlen=4):
+    """Compute a Metaphone style code for a string, based on the main rules
+       of the primary code of Double Metaphone (for example TH is encoded as
+       '0', SH and CH as 'X', and silent letters are removed). Only an initial
+       vowel is kept, as 'A'.
+    """
+
+    s = ''.join(s.split())  # Remove whitespaces
+
+    if (not s):
+        return ''
+
+    # Initial letter combinations
+    #
+    if (s[:2] in METAPHONE_INITIAL_DICT):
+        s = METAPHONE_INITIAL_DICT[s[:2]]+s[2:]
+    elif (s[0] in METAPHONE_INITIAL_DICT):
+        s = METAPHONE_INITIAL_DICT[s[0]]+s[1:]
+
+    vowels = 'aeiou'
+
+    code_list = []
+
+    s_len = len(s)
+
+    i = 0
+
+    while (i < s_len):
+
+        c    = s[i]
+        prev = s[i-1:i]  # Empty strings at start and end of the string
+        next = s[i+1:i+2]
+
+        if ((c == prev) and ((c != 'c') or (next == '') or (next not in 'eiy'))):
+            i += 1  # Repeated letters are encoded once, except CC before E, I, Y
+            continue
+
+        if (c in vowels):
+            if (i == 0):
+                code_list.append('a')
+
+        elif (c == 'b'):
+            if ((prev != 'm') or (i < s_len-1)):  # Silent in final MB
+                code_list.append('p')
+
+        elif (c == 'c'):
+            if (next == 'h'):
+                if (prev == 's'):  # SCH
+                    code_list.append('k')
+                else:
+                    code_list.append('x')
+                i += 1
+            elif (s[i+1:i+3] == 'ia'):
+                code_list.append('x')
+            elif ((next != '') and (next in 'eiy')):
+                if (prev != 's'):  # Silent in SCE, SCI and SCY
+                    code_list.append('s')
+            elif (next != 'k'):
+                code_list.append('k')
+
+        elif (c == 'd'):
+            if ((next == 'g') and (s[i+2:i+3] != '') and (s[i+2:i+3] in 'eiy')):
+                code_list.append('j')
+                i += 1
+            elif (next != 't'):  # DT is encoded by the T
+                code_list.append('t')
+
+        elif (c == 'g'):
+            after_next = s[i+2:i+3]
+
+            if (next == 'h'):
+                if ((after_next != '') and (after_next in vowels)):
+                    code_list.append('k')
+                i += 1  # Otherwise GH is silent
+            elif ((next == 'n') and ((after_next == '') or (s[i+2:i+4] == 'ed'))):
+                pass  # Silent in final GN and GNED
+            elif ((next != '') and (next in 'eiy')):
+                code_list.append('j')
+            else:
+                code_list.append('k')
+
+        elif (c == 'h'):
+            if ((next != '') and (next in vowels) and ((prev == '') or \
+                                                     (prev not in 'cgpst'))):
+                code_list.append('h')
+
+        elif (c == 'k'):
+            code_list.append('k')
+
+        elif (c == 'p'):
+            if (next == 'h'):
+                code_list.append('f')
+                i += 1
+            else:
+                code_list.append('p')
+
+                if (next == 'b'):  # PB is encoded as one P
+                    i += 1
+
+        elif (c == 's'):
+            if (next == 'h'):
+                code_list.append('x')
+                i += 1
+            elif (s[i+1:i+3] in ['io','ia']):
+                code_list.append('x')
+            else:
+                code_list.append('s')
+
+        elif (c == 't'):
+            if (s[i+1:i+3] in ['io','ia']):
+                code_list.append('x')
+            elif (next == 'h'):
+                code_list.append('0')
+                i += 1
+            elif (s[i+1:i+3] != 'ch'):  # Silent in TCH
+                code_list.append('t')
+
+        elif ((c == 'w') or (c == 'y')):
+            if ((next != '') and (next in vowels)):
+                code_list.append(c)
+
+        elif (c in METAPHONE_CODE_DICT):
+            code_list.append(METAPHONE_CODE_DICT[c])
+
+        i += 1
+
+    resstr = ''.join(code_list)
+
+    if (maxlen > 0):
+        resstr = resstr[:maxlen]  # Return first maxlen characters
+
+    return resstr
+
+# =============================================================================
+
+def sorted_qgram_prefix(s, q=2, num_qgrams=3):
+    """Return a key made of the alphabetically first 'num_qgrams' distinct
+       q-grams (sub-strings of length q) of a string (without whitespaces).
+       Strings that are not longer than q are returned unchanged.
+    """
+
+    assert (q > 0) and (num_qgrams > 0)
+
+    s = ''.join(s.split())  # Remove whitespaces
+
+    if (len(s) <= q):
+        return s
+
+    qgram_list = list(set([s[i:i+q] for i in xrange(len(s)-q+1)]))
+
+    qgram_list.sort()
+
+    return ''.join(qgram_list[:num_qgrams])
+
+# =============================================================================
+
+def collapse_repeats(s):
+    """Replace sequences of the same character in a string with one occurrence
+       of the character.
+    """
+
+    if (REPEAT_CHAR_REGEX.search(s) == None):  # No repeated characters
+        return s
+
+    resstr = s[0]
+
+    for i in s[1:]:
+        if (i != resstr[-1]):
+            resstr=resstr+i
+
+    return resstr
+
+# =============================================================================
+
 def get_substring(s, start_index, end_index):
     """Simple function to extract and return a substring from the given input
      string.
@@ -132,3 +385,261 @@ def get_substring(s, start_index, end_index):
     assert start_index <= end_index
 
     return s[start_index:end_index]
+
+# =============================================================================
+
+def encode_column(encode_funct, value_list, *args):
+    """Encode all values in the given list of strings (or other sequence, for
+       example a column of a data set) with the given encoding function and its
+       further arguments, and return the list of codes in the same order.
+
+       Each distinct value is encoded only once, and its code is then used for
+       all its occurrences.
+    """
+
+    code_dict = {}
+
+    for val in set(value_list):
+        code_dict[val] = encode_funct(val, *args)
+
+    return map(code_dict.__getitem__, value_list)
+
+# =============================================================================
+
+class LRUCache:
+    """Class that implements a cache of the values of the most recently used
+       keys.
+
+       At most 'max_size' values are kept, the value of the least recently used
+       key is removed when the cache is full. If 'max_size' is None the cache is
+       not bounded. The numbers of cache hits, misses and evictions are counted.
+       Values must not be None, as get() returns None for keys not cached.
+    """
+
+    # ---------------------------------------------------------------------------
+
+    def __init__(self, max_size = 100000):
+
+        if ((max_size != None) and ((not isinstance(max_size, int)) or \
+                                    (max_size < 1))):
+            logging.exception('Illegal cache "max_size" value: %s' % (str(max_size)))
+            raise Exception
+
+        self.max_size = max_size
+
+        self.clear()
+
+    # ---------------------------------------------------------------------------
+
+    def get(self, key):
+        """Return the cached value of the given key, or None if the key is not in
+           the cache.
+        """
+
+        link = self.cache_dict.get(key)
+
+        if (link == None):  # Cache miss
+            self.num_misses += 1
+            return None
+
+        self.num_hits += 1
+
+        if (self.max_size == None):
+            return link
+
+        # Move the entry to the most recently used end of the list
+        #
+        (link_prev, link_next, link_key, value) = link
+
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+
+        root = self.root
+        last = root[0]
+
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+        return value
+
+    # ---------------------------------------------------------------------------
+
+    def put(self, key, value):
+        """Put the value of the given key into the cache as the most recently
+           used one, and remove the value of the least recently used key if the
+           cache is full.
+        """
+
+        cache_dict = self.cache_dict
+
+        if (self.max_size == None):
+            cache_dict[key] = value
+            return
+
+        link = cache_dict.get(key)
+
+        if (link != None):  # Already cached, replace the value and move the
+            link[3] = value   # entry to the most recently used end of the list
+
+            (link_prev, link_next) = link[:2]
+
+            link_prev[1] = link_next
+            link_next[0] = link_prev
+
+            root = self.root
+            last = root[0]
+
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+
+            return
+
+        root = self.root
+
+        if (len(cache_dict) >= self.max_size):  # Remove least recently used
+            oldest = root[1]
+
+            oldest_next = oldest[1]
+
+            root[1] = oldest_next
+            oldest_next[0] = root
+
+            del cache_dict[oldest[2]]
+
+            self.num_evictions += 1
+
+        last = root[0]
+
+        link = [last, root, key, value]
+
+        last[1] = root[0] = cache_dict[key] = link
+
+    # ---------------------------------------------------------------------------
+
+    def clear(self):
+        """Remove all cached values and reset the counters.
+        """
+
+        # Cached values, for a bounded cache as entries [previous entry, next
+        # entry, key, value] of a circular list in least recently used order
+        #
+        self.cache_dict    = {}
+
+        self.root          = []
+
+        self.root[:]       = [self.root, self.root, None, None]
+
+        self.num_hits      = 0
+
+        self.num_misses    = 0
+
+        self.num_evictions = 0
+
+    # ---------------------------------------------------------------------------
+
+    def __len__(self):
+
+        return len(self.cache_dict)
+
+    # ---------------------------------------------------------------------------
+
+    def get_stats(self):
+        """Return a dictionary with the number of cache hits, misses and
+           evictions, the hit rate, and the number of cached values.
+        """
+
+        num_lookups = self.num_hits + self.num_misses
+
+        if (num_lookups > 0):
+            hit_rate = float(self.num_hits) / num_lookups
+        else:
+            hit_rate = 0.0
+
+        return {'hits':self.num_hits, 'misses':self.num_misses,
+                'evictions':self.num_evictions, 'hit_rate':hit_rate,
+                'size':len(self.cache_dict)}
+
+    # ---------------------------------------------------------------------------
+
+    def __getstate__(self):
+        """Return the attributes to be pickled (for example when an index
+           definition is sent to worker processes), with an empty cache.
+        """
+
+        return {'max_size':self.max_size}
+
+    # ---------------------------------------------------------------------------
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+        self.clear()
+
+# =============================================================================
+
+class CachedEncoder:
+    """Class that wraps an encoding function and caches the codes of the most
+       recently encoded strings in a LRUCache.
+
+       Instances are called like the wrapped function, so they can be used in
+       index definitions in place of the function, for example as
+       [encode.cached_nysiis, 3] instead of [encode.nysiis, 3]. The cache is
+       keyed on the string and all further arguments.
+
+       At most 'max_size' codes are kept (None for a cache that is not bounded),
+       see LRUCache.
+    """
+
+    # ---------------------------------------------------------------------------
+
+    def __init__(self, encode_funct, max_size = 100000):
+
+        if (not callable(encode_funct)):
+            logging.exception('Encoding function is not callable: %s' % \
+                              (str(encode_funct)))
+            raise Exception
+
+        self.encode_funct = encode_funct
+
+        self.cache        = LRUCache(max_size)
+
+    # ---------------------------------------------------------------------------
+
+    def __call__(self, s, *args):
+        """Return the code of the given string, from the cache if possible.
+        """
+
+        key = (s,)+args
+
+        code = self.cache.get(key)
+
+        if (code == None):  # Cache miss
+            code = self.encode_funct(s, *args)
+
+            self.cache.put(key, code)
+
+        return code
+
+    # ---------------------------------------------------------------------------
+
+    def clear(self):
+        """Remove all cached codes and reset the counters.
+        """
+
+        self.cache.clear()
+
+    # ---------------------------------------------------------------------------
+
+    def get_stats(self):
+        """Return a dictionary with the number of cache hits, misses and
+           evictions, the hit rate, and the number of cached codes.
+        """
+
+        return self.cache.get_stats()
+
+# =============================================================================
+
+cached_nysiis = CachedEncoder(nysiis)  # NYSIIS with a cache of recent codes
@@ -88,11 +88,11 @@ experiment_dict['census'] = ['Census', census_ds, census_ds,
 census_index_def1 = \
     [
         [
-            ['surname',     'surname',        False, False, None, [encode.nysiis,3]],
-            ['given_name',  'given_name',     False, False, None, [encode.nysiis,3]]
+            ['surname',     'surname',        False, False, None, [encode.cached_nysiis,3]],
+            ['given_name',  'given_name',     False, False, None, [encode.cached_nysiis,3]]
         ],
         [
-            ['suburb',      'suburb',         False, False, None, [encode.nysiis,3]],
+            ['suburb',      'suburb',         False, False, None, [encode.cached_nysiis,3]],
             ['zipcode',     'zipcode',        False, False, None, []]
         ]
     ]
@@ -100,25 +100,25 @@ census_index_def1 = \
 census_index_def2 = \
     [
         [
-            ['surname',         'surname',          False, False,   3,              [encode.nysiis,3]],
+            ['surname',         'surname',          False, False,   3,              [encode.cached_nysiis,3]],
             ['middle_initial',  'middle_initial',   False, False,   1,              []],
             ['zipcode',         'zipcode',          False, False, None,             []]
         ],
         [
-            ['given_name',      'given_name',       False, False, None,             [encode.nysiis,3]],
-            ['suburb',          'suburb',           False, False, None,             [encode.nysiis,3]]
+            ['given_name',      'given_name',       False, False, None,             [encode.cached_nysiis,3]],
+            ['suburb',          'suburb',           False, False, None,             [encode.cached_nysiis,3]]
         ]
     ]
 
 census_index_def3 = \
     [
         [
-            ['suburb',      'suburb',   False, False, None,             [encode.nysiis,3]],
-            ['surname',     'surname',  False, False,    3,             [encode.nysiis,3]]
+            ['suburb',      'suburb',   False, False, None,             [encode.cached_nysiis,3]],
+            ['surname',     'surname',  False, False,    3,             [encode.cached_nysiis,3]]
         ],
         [
             ['zipcode',     'zipcode',  False, False, None,             []],
-            ['given_name', 'given_name',False, False, None,             [encode.nysiis,3]]
+            ['given_name', 'given_name',False, False, None,             [encode.cached_nysiis,3]]
         ]
     ]
 
@@ -169,11 +169,11 @@ rest_index_def1 = \
     [
         [
             ['phone', 'phone', False, False, None, [encode.get_substring,0,4]],
-            ['type',  'type',  False, False, None, [encode.nysiis,3     ]]
+            ['type',  'type',  False, False, None, [encode.cached_nysiis,3     ]]
         ],
         [
-            ['name', 'name',   False, False, None, [encode.nysiis,3     ]],
-            ['city', 'city',   False, False, None, [encode.nysiis,3     ]]
+            ['name', 'name',   False, False, None, [encode.cached_nysiis,3     ]],
+            ['city', 'city',   False, False, None, [encode.cached_nysiis,3     ]]
         ]
 
     ]
@@ -181,24 +181,24 @@ rest_index_def1 = \
 rest_index_def2 = \
     [
         [
-            ['city', 'city',   False, False, None, [encode.nysiis,3     ]],
+            ['city', 'city',   False, False, None, [encode.cached_nysiis,3     ]],
             ['phone', 'phone', False, False, None, [encode.get_substring,0,4]]
         ],
         [
-            ['addr', 'addr',   False, False, None, [encode.nysiis,3     ]],
-            ['city', 'city',   False, False, None, [encode.nysiis,3     ]]
+            ['addr', 'addr',   False, False, None, [encode.cached_nysiis,3     ]],
+            ['city', 'city',   False, False, None, [encode.cached_nysiis,3     ]]
         ]
     ]
 
 rest_index_def3 = \
     [
         [
-            ['type', 'type',   False, False, None, [encode.nysiis,3     ]],
-            ['name', 'name',   False, False, None, [encode.nysiis,3     ]]
+            ['type', 'type',   False, False, None, [encode.cached_nysiis,3     ]],
+            ['name', 'name',   False, False, None, [encode.cached_nysiis,3     ]]
         ],
         [
-            ['addr', 'addr',   False, False, None, [encode.nysiis,3     ]],
-            ['type',  'type',  False, False, None, [encode.nysiis,3     ]]
+            ['addr', 'addr',   False, False, None, [encode.cached_nysiis,3     ]],
+            ['type',  'type',  False, False, None, [encode.cached_nysiis,3     ]]
         ]
     ]
 
@@ -223,6 +223,12 @@ get_id_funct        = experiment_dict[arg_data_set_name][5]
 
 index_def_list      = index_def_dict[arg_data_set_name]
 
+# All indices share one copy of the records, read only once
+#
+rec_store           = indexing.RecordStore(description = 'Records of ' + \
+                                           data_set_name,
+                                           dataset = data_set1)
+
 ds_index_list = []  # All indices defined for this data set (each entry is a
                   # tuple with the index method name and the actual index)
 
@@ -238,6 +244,7 @@ for w in [2,3,5,7,10]:
                                            dataset2 = data_set2,
                                            rec_comparator = rec_cmp,
                                            index_def = this_index_def,
+                                           rec_store = rec_store,
                                            window_s = w)
 
         ds_index_list.append(['sorted-inv-index', sorted_index])
@@ -287,7 +294,8 @@ for (index_name, index_method) in ds_index_list:
     ent_id_dict = {}  # Dictionary with all unique entity identifers and
                         # counts of how often they appear
 
-    for ent_rec in index_method.rec_cache1.itervalues():
+    for rec_num in xrange(len(index_method.rec_cache1)):
+        ent_rec = index_method.rec_cache1[rec_num]
         ent_id = get_id_funct(ent_rec)
         ent_id_count = ent_id_dict.get(ent_id, 0) + 1
         ent_id_dict[ent_id] = ent_id_count
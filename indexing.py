@@ -19,12 +19,469 @@
                              of the index variable definitions - uses an array
                              based approach where all index variable values
                              (including duplicates) are stored.
+
+    The records of a data set can be loaded once into a RecordStore, which can
+    then be shared by any number of indices built on that data set.
 """
 
 # =============================================================================
 # Import necessary modules (Python standard modules first, then Febrl modules)
+import array
 import gc
+import itertools
 import logging
+import multiprocessing
+import operator
+
+import encode
+
+# =============================================================================
+
+class RecordStore:
+    """Class that holds the normalised (lower-cased) field values of all records
+       of a data set, so that several indices on the same data set only need to
+       read and normalise the data set once, and only keep one copy of it.
+
+       Records are identified by dense integer record numbers (0 to
+       num_records-1), their original record identifiers are only kept in the
+       list 'rec_ident_list'. Each stored field is dictionary-encoded: a table
+       of its distinct values (with the empty string always having code 0), and
+       a column with the value code of each record.
+
+       Only the fields in the given field name list are kept (all fields if no
+       list is given), values of all other fields are set to empty strings.
+
+       Records are read and encoded in blocks of 'batch_size' records. If
+       'num_workers' is larger than 1, chunks of the data set are read and
+       encoded in parallel by that many worker processes.
+    """
+
+    # ---------------------------------------------------------------------------
+
+    def __init__(self, **kwargs):
+
+        self.description    =   ''
+
+        self.dataset        =   None
+
+        self.field_list     =   None  # Names of the fields to keep
+
+        self.field_col_list =   None
+
+        self.num_fields     =   None
+
+        self.num_records    =   0
+
+        self.rec_ident_list =   []  # Record identifiers in record number order
+
+        self.col_code_list  =   []  # Per field an array of value codes, or None
+
+        self.col_value_list =   []  # Per field a list of distinct values, or None
+
+        self.code_dict_list =   None  # Codes of distinct values, used when loading
+
+        self.num_workers    =   1
+
+        self.batch_size     =   10000  # Number of records read per block
+
+        for (keyword, value) in kwargs.items():
+
+            if (keyword.startswith('desc')):
+                self.description = value
+
+            elif (keyword == 'dataset'):
+                self.dataset = value
+
+            elif (keyword.startswith('field_l')):
+                self.field_list = value
+
+            elif (keyword.startswith('num_w')):
+                self.num_workers = value
+
+            elif (keyword.startswith('batch')):
+                if ((not isinstance(value, int)) or (value < 1)):
+                    logging.exception('Illegal "batch_size" value: %s' % (str(value)))
+                    raise Exception
+                self.batch_size = value
+
+            else:
+                logging.exception('Illegal constructor argument keyword: '+keyword)
+                raise Exception
+
+        if (self.dataset == None):
+            logging.exception('Argument "dataset" must be given')
+            raise Exception
+
+        dataset_field_names = []
+
+        for (field_name, field_data) in self.dataset.field_list:
+            dataset_field_names.append(field_name)
+
+        self.num_fields = len(dataset_field_names)
+
+        if (self.field_list == None):
+            self.field_col_list = range(self.num_fields)
+
+        else:
+            self.field_col_list = []
+
+            for field_name in self.field_list:
+                if (field_name not in dataset_field_names):
+                    logging.exception('Field "%s" is not in data set field name list: ' % \
+                        (field_name) + '%s' % (str(self.dataset.field_list)))
+                    raise Exception
+
+                self.field_col_list.append(dataset_field_names.index(field_name))
+
+            self.field_col_list.sort()
+
+        self.status = 'initialised'
+
+    # ---------------------------------------------------------------------------
+
+    def load(self):
+        """Read all records from the data set and keep their normalised values of
+           the stored fields.
+        """
+
+        if (self.num_workers > 1):
+            self.load_parallel(self.num_workers)
+        else:
+            self.__load_sequential__()
+
+    # ---------------------------------------------------------------------------
+
+    def __load_sequential__(self):
+        """Read all records from the data set in this process.
+        """
+
+        self.__init_columns__()
+
+        prev_proj_col_list = self.dataset.proj_col_list
+
+        self.dataset.set_projection(self.field_col_list)
+
+        try:
+            self.__encode_batches__(self.dataset.read_batches(self.batch_size))
+
+        finally:  # Keep the projection set by the caller of the data set
+            self.dataset.set_projection(prev_proj_col_list)
+
+        self.num_records    = len(self.rec_ident_list)
+
+        self.code_dict_list = None
+
+        self.status = 'loaded'
+
+    # ---------------------------------------------------------------------------
+
+    def load_parallel(self, num_workers, indexing = None):
+        """Read all records from the data set using the given number of worker
+           processes, each reading and encoding chunks of the data set file,
+           which are then merged in data set order.
+
+           If an index is given, the workers also compute the index variable
+           values of their chunks, and the chunk indices are merged into the
+           index as well.
+
+           Data sets that cannot be split into chunks (compressed files) are read
+           sequentially.
+        """
+
+        chunk_offset_list = self.dataset.get_chunk_offsets(4*num_workers)
+
+        if (chunk_offset_list == None):
+            logging.info('Data set cannot be split into chunks, reading it ' + \
+                         'sequentially')
+
+            self.__load_sequential__()
+
+            if (indexing != None):
+                indexing.__add_store_to_index__(indexing.index1, self, 0)
+
+            return
+
+        self.__init_columns__()
+
+        prev_proj_col_list = self.dataset.proj_col_list
+
+        self.dataset.set_projection(self.field_col_list)
+
+        worker_pool = None
+
+        try:
+            chunk_task_list = []
+
+            for (start_offset, end_offset) in chunk_offset_list:
+                chunk_task_list.append((self, indexing, start_offset, end_offset))
+
+            worker_pool = multiprocessing.Pool(num_workers)
+
+            for (chunk_data, chunk_index) in worker_pool.imap(ingest_chunk,
+                                                              chunk_task_list):
+
+                rec_num_offset = len(self.rec_ident_list)
+
+                self.__merge_chunk__(chunk_data)
+
+                if (indexing != None):
+                    indexing.__merge_chunk_index__(chunk_index, rec_num_offset)
+
+            worker_pool.close()
+            worker_pool.join()
+
+            worker_pool = None
+
+        finally:
+            if (worker_pool != None):  # A chunk failed, stop all workers
+                worker_pool.terminate()
+                worker_pool.join()
+
+            # Keep the projection set by the caller of the data set
+            #
+            self.dataset.set_projection(prev_proj_col_list)
+
+        self.num_records    = len(self.rec_ident_list)
+
+        self.code_dict_list = None
+
+        if (self.dataset.num_records == None):  # Not counted yet (lazy count)
+            self.dataset.num_records = self.num_records
+
+        self.status = 'loaded'
+
+    # ---------------------------------------------------------------------------
+
+    def __init_columns__(self):
+        """Initialise empty columns and value code dictionaries for all stored
+           fields.
+        """
+
+        num_fields = self.num_fields
+
+        self.rec_ident_list = []
+
+        self.col_code_list  = [None] * num_fields
+
+        self.col_value_list = [None] * num_fields
+
+        self.code_dict_list = [None] * num_fields
+
+        for field_col in self.field_col_list:
+            self.col_code_list[field_col]  = array.array('i')
+            self.col_value_list[field_col] = ['']
+            self.code_dict_list[field_col] = {'':0}
+
+    # ---------------------------------------------------------------------------
+
+    def __encode_batches__(self, batch_iter):
+        """Append the records from the given iterator over blocks of records (as
+           returned by the read_batches() method of data sets) to the encoded
+           columns. Each block is encoded a column at a time.
+        """
+
+        field_col_list = self.field_col_list
+
+        rec_ident_list = self.rec_ident_list
+
+        col_code_list  = self.col_code_list
+
+        col_value_list = self.col_value_list
+
+        code_dict_list = self.code_dict_list
+
+        rec_ident_fmt  = str(self.dataset.rec_ident)+'-%d'
+
+        for (first_rec_num, num_recs, batch_ident_list, batch_col_list) in batch_iter:
+
+            for field_col in field_col_list:
+
+                col_vals = [val.lower() for val in batch_col_list[field_col]]
+
+                code_dict  = code_dict_list[field_col]
+
+                value_list = col_value_list[field_col]
+
+                new_val_set = set(col_vals).difference(code_dict)
+
+                if (new_val_set != set()):  # Add new distinct values in record order
+                    for val in col_vals:
+                        if (val in new_val_set):
+                            code_dict[val] = len(code_dict)
+                            value_list.append(val)
+                            new_val_set.remove(val)
+
+                            if (new_val_set == set()):
+                                break
+
+                col_code_list[field_col].extend(map(code_dict.__getitem__, col_vals))
+
+            if (batch_ident_list == None):  # Generate record identifiers
+                rec_ident_list.extend([rec_ident_fmt % (rec_num) for rec_num in \
+                                       xrange(first_rec_num, first_rec_num+num_recs)])
+            else:
+                rec_ident_list.extend(batch_ident_list)
+
+    # ---------------------------------------------------------------------------
+
+    def __merge_chunk__(self, chunk_data):
+        """Append the encoded records of a chunk read by a worker process, as
+           returned by ingest_chunk(), re-mapping the chunk's value codes.
+        """
+
+        (chunk_rec_ident_list, chunk_num_records, chunk_code_list,
+         chunk_value_list) = chunk_data
+
+        rec_num_offset = len(self.rec_ident_list)
+
+        for field_col in self.field_col_list:
+
+            code_dict  = self.code_dict_list[field_col]
+
+            value_list = self.col_value_list[field_col]
+
+            code_map_list = []  # Chunk value codes to store value codes
+
+            for val in chunk_value_list[field_col]:
+                code = code_dict.get(val)
+
+                if (code == None):  # A new distinct value
+                    code = len(code_dict)
+                    code_dict[val] = code
+                    value_list.append(val)
+
+                code_map_list.append(code)
+
+            self.col_code_list[field_col].extend([code_map_list[code] for code in \
+                                                  chunk_code_list[field_col]])
+
+        if (self.dataset.rec_ident_col == -1):  # Generate record identifiers
+            rec_ident_fmt = str(self.dataset.rec_ident)+'-%d'
+
+            for rec_num in xrange(chunk_num_records):
+                self.rec_ident_list.append(rec_ident_fmt % (rec_num_offset+rec_num))
+
+        else:
+            self.rec_ident_list.extend(chunk_rec_ident_list)
+
+    # ---------------------------------------------------------------------------
+
+    def check_fields(self, field_col_list):
+        """Check that all the given field columns are kept in this store.
+        """
+
+        for field_col in field_col_list:
+            if (field_col not in self.field_col_list):
+                logging.exception('Field column %d is not kept in record store: %s' % \
+                    (field_col, str(self.field_col_list)))
+                raise Exception
+
+    # ---------------------------------------------------------------------------
+
+    def remove_fields(self, field_col_list):
+        """Remove the given field columns from the store to free their memory.
+        """
+
+        for field_col in field_col_list:
+            if (field_col in self.field_col_list):
+                self.field_col_list.remove(field_col)
+
+                if (self.col_code_list != []):
+                    self.col_code_list[field_col]  = None
+                    self.col_value_list[field_col] = None
+
+    # ---------------------------------------------------------------------------
+
+    def get_rec_ident(self, rec_num):
+        """Return the original record identifier of the given record number.
+        """
+
+        return self.rec_ident_list[rec_num]
+
+    # ---------------------------------------------------------------------------
+
+    def __len__(self):
+
+        return self.num_records
+
+    # ---------------------------------------------------------------------------
+
+    def __getitem__(self, rec_num):
+        """Return the record with the given record number as a list of all its
+           field values (with empty strings for fields that are not kept).
+        """
+
+        col_code_list  = self.col_code_list
+
+        col_value_list = self.col_value_list
+
+        rec = [''] * self.num_fields
+
+        for field_col in self.field_col_list:
+            rec[field_col] = col_value_list[field_col][col_code_list[field_col][rec_num]]
+
+        return rec
+
+    # ---------------------------------------------------------------------------
+
+    def get_value_counts(self, field_col):
+        """Return an array with the number of records that have each distinct
+           value of the given field, in the order of the field's value list.
+        """
+
+        count_array = array.array('i', [0]) * len(self.col_value_list[field_col])
+
+        for code in self.col_code_list[field_col]:
+            count_array[code] += 1
+
+        return count_array
+
+    # ---------------------------------------------------------------------------
+
+    def get_value(self, rec_num, field_col):
+        """Return the value of the given field of the given record number.
+        """
+
+        return self.col_value_list[field_col][self.col_code_list[field_col][rec_num]]
+
+# =============================================================================
+
+def ingest_chunk(chunk_task):
+    """Read and encode one chunk of a data set into a record store, and if an
+       index is given also compute the chunk's index. This function is run in
+       worker processes by RecordStore.load_parallel(), it returns a tuple with
+       the encoded chunk data and the chunk index (or None).
+    """
+
+    (rec_store, indexing, start_offset, end_offset) = chunk_task
+
+    rec_store.__init_columns__()
+
+    rec_store.__encode_batches__(rec_store.dataset.read_chunk(start_offset, end_offset,
+                                                             rec_store.batch_size))
+
+    rec_store.num_records = len(rec_store.rec_ident_list)
+
+    if (rec_store.dataset.rec_ident_col == -1):  # Identifiers are only relative
+        chunk_rec_ident_list = None
+    else:
+        chunk_rec_ident_list = rec_store.rec_ident_list
+
+    chunk_data = (chunk_rec_ident_list, rec_store.num_records,
+                  rec_store.col_code_list, rec_store.col_value_list)
+
+    if (indexing != None):
+        chunk_index = {}
+
+        for i in range(len(indexing.index_def)):
+            chunk_index[i] = {}
+
+        indexing.__add_store_to_index__(chunk_index, rec_store, 0)
+
+    else:
+        chunk_index = None
+
+    return (chunk_data, chunk_index)
 
 # =============================================================================
 
@@ -50,9 +507,9 @@ class Indexing:
 
         self.index2     = {}
 
-        self.rec_cache1 = {}
+        self.rec_cache1 = None  # Record store, set when the index is built
 
-        self.rec_cache2 = {}
+        self.rec_cache2 = None
 
         self.num_rec_pairs    = None
 
@@ -64,6 +521,14 @@ class Indexing:
 
         self.rec_length_cache = {}
 
+        self.rec_store        = None  # Optional record store shared with others
+
+        self.num_workers      = 1  # Number of processes used to read the records
+
+        self.distinct_value_pairs = False  # Compare each record pair separately
+
+        self.early_cut_off    = False  # Compare all fields of all record pairs
+
         for (keyword, value) in base_kwargs.items():
 
             if (keyword.startswith('desc')):
@@ -87,10 +552,34 @@ class Indexing:
             elif (keyword.startswith('skip')):
                 self.skip_missing = value
 
+            elif (keyword.startswith('rec_st')):
+                self.rec_store = value
+
+            elif (keyword.startswith('num_w')):
+                self.num_workers = value
+
+            elif (keyword.startswith('distinct')):
+                if (value not in [True, False]):
+                    logging.exception('Argument "distinct_value_pairs" must be ' + \
+                                      'True or False: %s' % (str(value)))
+                    raise Exception
+                self.distinct_value_pairs = value
+
+            elif (keyword.startswith('early')):
+                if (value not in [True, False]):
+                    logging.exception('Argument "early_cut_off" must be True or ' + \
+                                      'False: %s' % (str(value)))
+                    raise Exception
+                self.early_cut_off = value
+
             else:
                 logging.exception('Illegal constructor argument keyword: '+keyword)
                 raise Exception
 
+        if ((self.rec_store != None) and (self.rec_store.dataset != self.dataset1)):
+            logging.exception('Record store is not based on data set 1')
+            raise Exception
+
         dataset1_field_names = []
 
         dataset2_field_names = []
@@ -112,6 +601,11 @@ class Indexing:
 
         self.comp_field_used2.sort()
 
+        # Record comparator for records with only the values of compared fields
+        #
+        self.proj_rec_comparator = self.rec_comparator.get_projected_comparator(
+                                   self.comp_field_used1, self.comp_field_used2)
+
         self.index_def_proc = []
 
         for index_def_list in self.index_def:
@@ -167,42 +661,167 @@ class Indexing:
             self.index1[i] = {}
             self.index2[i] = {}
 
-        skip_missing    = self.skip_missing
+        # Both records of a pair are taken from the store (deduplication), so it
+        # also needs the fields data set 2 is compared on
+        #
+        store_field_list = self.__get_field_used_list__(0)
 
-        get_index_values_funct = self.__get_index_values__
+        for field_col in self.comp_field_used2:
+            if (field_col not in store_field_list):
+                store_field_list.append(field_col)
 
-        build_list = [(self.index1, self.rec_cache1, self.dataset1, self.comp_field_used1, 0)]
+        store_field_list.sort()
 
-        for (index, rec_cache, dataset, comp_field_used_list, ds_index) in build_list:
+        if (self.rec_store != None):  # Records are shared with other indices
+            rec_store = self.rec_store
 
-            for (rec_ident, rec) in dataset.readall():
+            rec_store.check_fields(store_field_list)
 
-                comp_rec = []
+        else:  # Private store with only the fields needed by this index
+            field_names = []
 
-                field_ind = 0
+            for field_col in store_field_list:
+                field_names.append(self.dataset1.field_list[field_col][0])
 
-                for field in rec:
-                    if (field_ind in comp_field_used_list):
-                        comp_rec.append(field.lower())
-                    else:
-                        comp_rec.append('')
-                    field_ind += 1
+            rec_store = RecordStore(description = 'Records of ' + self.description,
+                                    dataset = self.dataset1,
+                                    field_list = field_names)
+
+        self.rec_cache1 = rec_store
+
+        if ((self.rec_store == None) and (self.num_workers > 1)):
+
+            # Records are read and indexed in parallel chunks
+            #
+            rec_store.load_parallel(self.num_workers, self)
+
+        else:
+            if (rec_store.status != 'loaded'):
+                rec_store.load()
+
+            self.__add_store_to_index__(self.index1, rec_store, 0)
+
+        self.__set_value_frequencies__(rec_store)
+
+        # Fields only used for indexing are not needed anymore in a private store
+        #
+        if (self.rec_store == None):
+            index_field_list = []
+
+            for field_col in store_field_list:
+                if ((field_col not in self.comp_field_used1) and \
+                    (field_col not in self.comp_field_used2)):
+                    index_field_list.append(field_col)
+
+            rec_store.remove_fields(index_field_list)
+
+    # ---------------------------------------------------------------------------
+
+    def __set_value_frequencies__(self, rec_store):
+        """Count the values of the compared fields in the record store and give
+           the counts to the field comparators that use frequency based agreement
+           weights.
+        """
+
+        for i in range(self.rec_comparator.num_fields):
+            field_comp = self.rec_comparator.field_comparator_list[i][0]
+
+            if (field_comp.freq_weights == True):
+                field_col = self.rec_comparator.field_comparison_list[i][1]
+
+                field_comp.set_value_frequencies(rec_store.col_value_list[field_col],
+                                                 rec_store.get_value_counts(field_col))
+
+    # ---------------------------------------------------------------------------
+
+    def __add_store_to_index__(self, index, rec_store, data_set_num):
+        """Insert the record numbers of all records in the given record store into
+           the blocks of the given index (a dictionary with one inverted index
+           per index definition).
+        """
+
+        skip_missing = self.skip_missing
+
+        get_index_values_funct = self.__get_store_index_values__
+
+        for i in range(len(self.index_def)):
+
+            this_index = index[i]
+
+            rec_num = 0
+
+            for block_val in get_index_values_funct(rec_store, data_set_num, i):
+
+                if ((block_val != '') or (skip_missing == False)):
+                    block_val_rec_list = this_index.get(block_val, [])
+                    block_val_rec_list.append(rec_num)
+                    this_index[block_val] = block_val_rec_list
+
+                rec_num += 1
+
+    # ---------------------------------------------------------------------------
+
+    def __merge_chunk_index__(self, chunk_index, rec_num_offset):
+        """Merge the index of a chunk of records (computed by a worker process)
+           into the index of data set 1, shifting the chunk's record numbers by
+           the given offset.
+        """
+
+        for i in range(len(self.index_def)):
+
+            this_index = self.index1[i]
+
+            for (block_val, chunk_rec_list) in chunk_index[i].iteritems():
+
+                block_val_rec_list = this_index.get(block_val, [])
+                block_val_rec_list.extend([rec_num_offset+rec_num for rec_num in \
+                                           chunk_rec_list])
+                this_index[block_val] = block_val_rec_list
+
+    # ---------------------------------------------------------------------------
+
+    def __getstate__(self):
+        """Return the attributes to be pickled when the index is sent to worker
+           processes: only what is needed to compute index variable values.
+        """
+
+        state = self.__dict__.copy()
+
+        for attr_name in ['rec_comparator', 'proj_rec_comparator', 'rec_store',
+                          'rec_cache1', 'rec_cache2']:
+            state[attr_name] = None
+
+        for attr_name in ['index1', 'index2', 'rec_length_cache']:
+            state[attr_name] = {}
 
-                rec_cache[rec_ident] = comp_rec
+        state.pop('rec_pair_dict', None)
 
-                rec_index_val_list = get_index_values_funct(rec, ds_index)
+        return state
 
-                for i in range(num_indices):
+    # ---------------------------------------------------------------------------
+
+    def __get_field_used_list__(self, data_set_num):
+        """Return a sorted list of the columns of the given data set that are
+           used by the record comparator or in the index definitions.
+        """
 
-                    this_index  = index[i]
+        assert (data_set_num == 0) or (data_set_num == 1)
+
+        if (data_set_num == 0):
+            field_used_list = self.comp_field_used1[:]
+        else:
+            field_used_list = self.comp_field_used2[:]
+
+        for index_def_list in self.index_def_proc:
+            for index_def in index_def_list:
+                field_col = index_def[data_set_num]
 
-                    block_val   = rec_index_val_list[i]
+                if (field_col not in field_used_list):
+                    field_used_list.append(field_col)
 
-                    if ((block_val != '') or (skip_missing == False)):
-                        block_val_rec_list = this_index.get(block_val, [])
-                        block_val_rec_list.append(rec_ident)
-                        this_index[block_val] = block_val_rec_list
+        field_used_list.sort()
 
+        return field_used_list
     # ---------------------------------------------------------------------------
 
     def __dedup_rec_pairs__(self, rec_id_list, rec_pair_dict):
@@ -213,17 +832,17 @@ class Indexing:
 
         this_rec_id_list.sort()
 
-        for rec_ident1 in this_rec_id_list:
+        for rec_num1 in this_rec_id_list:
 
-            rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
+            rec_num2_set = rec_pair_dict.get(rec_num1, set())
 
-            for rec_ident2 in this_rec_id_list[rec_cnt:]:
+            for rec_num2 in this_rec_id_list[rec_cnt:]:
 
-                assert rec_ident1 != rec_ident2
+                assert rec_num1 != rec_num2
 
-                rec_ident2_set.add(rec_ident2)
+                rec_num2_set.add(rec_num2)
 
-            rec_pair_dict[rec_ident1] = rec_ident2_set
+            rec_pair_dict[rec_num1] = rec_num2_set
 
             rec_cnt += 1
 
@@ -244,12 +863,289 @@ class Indexing:
 
         weight_vec_dict  = {}
 
+        if (self.distinct_value_pairs == True):
+            rec_ident_list = self.rec_cache1.rec_ident_list
+
+            num_fields = self.rec_comparator.num_fields
+
+            (rec_num_array1, rec_num_array2, w_vec_matrix) = \
+                self.__compare_distinct_value_pairs__(length_filter_perc, cut_off_threshold)
+
+            offset = 0
+
+            for (rec_num1, rec_num2) in itertools.izip(rec_num_array1, rec_num_array2):
+                weight_vec_dict[(rec_ident_list[rec_num1], rec_ident_list[rec_num2])] = \
+                    w_vec_matrix[offset:offset+num_fields].tolist()
+
+                offset += num_fields
+
+            return [self.__get_field_names_list__(), weight_vec_dict]
+
+        for (rec_ident1, rec_ident2, w_vec) in \
+            self.iter_weight_vectors(length_filter_perc, cut_off_threshold):
+            weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+
+        return [self.__get_field_names_list__(), weight_vec_dict]
+
+    # ---------------------------------------------------------------------------
+
+    def iter_weight_vectors(self, length_filter_perc = None, cut_off_threshold = None):
+        """An iterator which compares the record pairs of the compacted index and
+           returns one tuple (record identifier 1, record identifier 2, weight
+           vector) per compared record pair, with the same filtering as run().
+
+           Unlike run(), the weight vectors are not collected in a dictionary, so
+           they can be streamed (for example into a data set opened for writing)
+           in constant memory.
+        """
+
+        rec_ident_list1 = self.rec_cache1.rec_ident_list
+
+        rec_ident_list2 = rec_ident_list1
+
+        rec_comp        = self.proj_rec_comparator.compare
+
+        rec_comp_cut_off = self.__get_rec_comp_cut_off__(cut_off_threshold)
+
+        num_rec_pairs_below_thres = 0
+
+        for (rec_num1, rec1, rec_num2, rec2) in \
+            self.__get_rec_pairs_to_compare__(length_filter_perc):
+
+            if (rec_comp_cut_off != None):
+                w_vec = rec_comp_cut_off(rec1, rec2, cut_off_threshold)
+
+                if (w_vec == None):  # Comparison abandoned
+                    num_rec_pairs_below_thres += 1
+                    continue
+            else:
+                w_vec = rec_comp(rec1, rec2)
+
+            if (cut_off_threshold == None) or (sum(w_vec) >= cut_off_threshold):
+                yield (rec_ident_list1[rec_num1], rec_ident_list2[rec_num2], w_vec)
+            else:
+                num_rec_pairs_below_thres += 1
+
+        if (rec_comp_cut_off != None):
+            self.__log_cut_off_stats__()
+
+    # ---------------------------------------------------------------------------
+
+    def run_matrix(self, length_filter_perc = None, cut_off_threshold = None):
+        """Compare the record pairs of the compacted index with the same filtering
+           as run(), but return the weight vectors in one contiguous matrix
+           instead of a dictionary.
+
+           Returns a list [field names list, record number array 1, record number
+           array 2, weight vector matrix]. The matrix is an array of doubles with
+           one row of weights per kept record pair, the weights of pair i start at
+           position i*num_fields. The record numbers of pair i are at position i
+           of the two record number arrays, their record identifiers can be
+           obtained with rec_cache1.get_rec_ident().
+        """
+
+        if (self.distinct_value_pairs == True):
+            return [self.__get_field_names_list__()] + \
+                list(self.__compare_distinct_value_pairs__(length_filter_perc,
+                                                           cut_off_threshold))
+
+        num_fields = self.rec_comparator.num_fields
+
+        rec_comp_into = self.proj_rec_comparator.compare_into
+
+        rec_num_array1 = array.array('i')
+
+        rec_num_array2 = array.array('i')
+
+        # Allocate rows for all record pairs, unused rows are removed at the end
+        #
+        w_vec_matrix = array.array('d', [0.0]) * ((self.num_rec_pairs or 0) * num_fields)
+
+        rec_comp_cut_off = self.__get_rec_comp_cut_off__(cut_off_threshold)
+
+        offset = 0
+
+        for (rec_num1, rec1, rec_num2, rec2) in \
+            self.__get_rec_pairs_to_compare__(length_filter_perc):
+
+            if (offset == len(w_vec_matrix)):  # More pairs than counted
+                w_vec_matrix.extend([0.0] * num_fields)
+
+            if (rec_comp_cut_off != None):
+                w_vec = rec_comp_cut_off(rec1, rec2, cut_off_threshold)
+
+                if (w_vec == None):  # Comparison abandoned
+                    continue
+
+                w_vec_matrix[offset:offset+num_fields] = array.array('d', w_vec)
+
+                w_sum = sum(w_vec)
+
+            else:
+                w_sum = rec_comp_into(rec1, rec2, w_vec_matrix, offset)
+
+            if (cut_off_threshold == None) or (w_sum >= cut_off_threshold):
+                rec_num_array1.append(rec_num1)
+                rec_num_array2.append(rec_num2)
+
+                offset += num_fields
+
+        del w_vec_matrix[offset:]
+
+        if (rec_comp_cut_off != None):
+            self.__log_cut_off_stats__()
+
+        return [self.__get_field_names_list__(), rec_num_array1, rec_num_array2,
+                w_vec_matrix]
+
+    # ---------------------------------------------------------------------------
+
+    def __get_rec_comp_cut_off__(self, cut_off_threshold):
+        """Return the compare_cut_off() method of the record comparator if
+           comparisons are to be abandoned early and a cut-off threshold is
+           given, otherwise None. The comparator's counters are reset.
+        """
+
+        if ((self.early_cut_off == False) or (cut_off_threshold == None)):
+            return None
+
+        self.proj_rec_comparator.num_cut_off_rec_pairs  = 0
+
+        self.proj_rec_comparator.num_skipped_field_comp = 0
+
+        return self.proj_rec_comparator.compare_cut_off
+
+    # ---------------------------------------------------------------------------
+
+    def __log_cut_off_stats__(self):
+        """Log the numbers of record pairs and field comparisons skipped because
+           the cut-off threshold could not be reached.
+        """
+
+        rec_comp = self.rec_comparator  # Also keep the counts in the given comparator
+
+        rec_comp.num_cut_off_rec_pairs  = self.proj_rec_comparator.num_cut_off_rec_pairs
+
+        rec_comp.num_skipped_field_comp = self.proj_rec_comparator.num_skipped_field_comp
+
+        logging.info('Cut-off: %d record pairs abandoned, %d field comparisons ' % \
+                     (rec_comp.num_cut_off_rec_pairs, rec_comp.num_skipped_field_comp) + \
+                     'skipped')
+
+    # ---------------------------------------------------------------------------
+
+    def __compare_distinct_value_pairs__(self, length_filter_perc = None, cut_off_threshold = None):
+        """Compare the record pairs of the compacted index with the same filtering
+           as run(), but compare each distinct pair of field values only once.
+
+           For each field comparison the value codes of the two records in the
+           record store are joined into one code per record pair, the field
+           comparator is called once per distinct code, and the weights are
+           scattered into the weight vector matrix. Returns a tuple (record
+           number array 1, record number array 2, weight vector matrix) in the
+           format of run_matrix().
+        """
+
+        rec_store = self.rec_cache1
+
+        num_fields = self.rec_comparator.num_fields
+
+        rec_num_array1 = array.array('i')
+
+        rec_num_array2 = array.array('i')
+
+        if (length_filter_perc == None):  # Records are not needed
+            for (rec_num1, rec_num2_set) in self.rec_pair_dict.iteritems():
+                rec_num_array1.extend([rec_num1] * len(rec_num2_set))
+                rec_num_array2.extend(rec_num2_set)
+
+        else:
+            for (rec_num1, rec1, rec_num2, rec2) in \
+                self.__get_rec_pairs_to_compare__(length_filter_perc):
+                rec_num_array1.append(rec_num1)
+                rec_num_array2.append(rec_num2)
+
+        num_rec_pairs = len(rec_num_array1)
+
+        w_vec_matrix = array.array('d', [0.0]) * (num_rec_pairs * num_fields)
+
+        w_sum_list = [0.0] * num_rec_pairs
+
+        field_num = 0
+
+        for (comp_funct, field_col1, field_col2) in \
+            self.rec_comparator.field_comparison_list:
+
+            value_list1 = rec_store.col_value_list[field_col1]
+
+            value_list2 = rec_store.col_value_list[field_col2]
+
+            num_codes2 = len(value_list2)
+
+            # Join the value codes of the two records into one code per pair
+            #
+            code_list1 = map(rec_store.col_code_list[field_col1].__getitem__,
+                             rec_num_array1)
+
+            code_list2 = map(rec_store.col_code_list[field_col2].__getitem__,
+                             rec_num_array2)
+
+            pair_code_list = [code1*num_codes2 + code2 for (code1, code2) in \
+                              itertools.izip(code_list1, code_list2)]
+
+            pair_weight_dict = {}  # Weights of the distinct value pairs
+
+            for pair_code in set(pair_code_list):
+                pair_weight_dict[pair_code] = \
+                    comp_funct(value_list1[pair_code / num_codes2],
+                               value_list2[pair_code % num_codes2])
+
+            logging.info('Field comparison %d: %d distinct value pairs in %d ' % \
+                         (field_num, len(pair_weight_dict), num_rec_pairs) + \
+                         'record pairs')
+
+            w_list = map(pair_weight_dict.__getitem__, pair_code_list)
+
+            w_vec_matrix[field_num::num_fields] = array.array('d', w_list)
+
+            w_sum_list = map(operator.add, w_sum_list, w_list)
+
+            field_num += 1
+
+        if (cut_off_threshold != None):  # Only keep pairs with large enough weights
+            keep_list = [i for i in xrange(num_rec_pairs) if \
+                         w_sum_list[i] >= cut_off_threshold]
+
+            if (len(keep_list) < num_rec_pairs):
+                rec_num_array1 = array.array('i', map(rec_num_array1.__getitem__,
+                                                      keep_list))
+                rec_num_array2 = array.array('i', map(rec_num_array2.__getitem__,
+                                                      keep_list))
+
+                all_w_vec_matrix = w_vec_matrix
+
+                w_vec_matrix = array.array('d')
+
+                for i in keep_list:
+                    w_vec_matrix.extend(all_w_vec_matrix[i*num_fields:(i+1)*num_fields])
+
+        return (rec_num_array1, rec_num_array2, w_vec_matrix)
+
+    # ---------------------------------------------------------------------------
+
+    def __get_rec_pairs_to_compare__(self, length_filter_perc = None):
+        """An iterator which returns tuples (record number 1, record 1, record
+           number 2, record 2) for all record pairs of the compacted index that
+           are not removed by the length filter.
+
+           Records only contain the values of the compared fields of their data
+           set (in column order), they are compared with 'proj_rec_comparator'.
+        """
+
         rec_cache1       = self.rec_cache1
 
         rec_pair_dict    = self.rec_pair_dict
 
-        rec_comp         = self.rec_comparator.compare
-
         rec_length_cache = self.rec_length_cache
 
         if (length_filter_perc != None):
@@ -257,111 +1153,145 @@ class Indexing:
 
         num_rec_pairs_filtered    = 0
 
-        num_rec_pairs_below_thres = 0
-
         rec_cache2 = self.rec_cache1
 
-        for rec_ident1 in rec_pair_dict:
+        # Value codes and values of the compared fields of both data sets
+        #
+        comp_col_list1 = []
 
-            rec1 = rec_cache1[rec_ident1]
+        for field_col in self.comp_field_used1:
+            comp_col_list1.append((rec_cache1.col_code_list[field_col],
+                                   rec_cache1.col_value_list[field_col]))
 
-            if (length_filter_perc != None):
-                rec1_len = len(''.join(rec1))
+        comp_col_list2 = []
 
-            for rec_ident2 in rec_pair_dict[rec_ident1]:
+        for field_col in self.comp_field_used2:
+            comp_col_list2.append((rec_cache2.col_code_list[field_col],
+                                   rec_cache2.col_value_list[field_col]))
 
-                rec2 = rec_cache2[rec_ident2]
+        for rec_num1 in rec_pair_dict:
 
-                do_comp = True
+            rec1 = [value_list[code_array[rec_num1]] for (code_array, value_list) \
+                    in comp_col_list1]
 
-                if (length_filter_perc != None):
-                    if (rec_ident2 in rec_length_cache):
-                        rec2_len = rec_length_cache[rec_ident2]
+            if (length_filter_perc != None):
+                rec1_len = len(''.join(rec1))
+
+            for rec_num2 in rec_pair_dict[rec_num1]:
+
+                if (length_filter_perc != None):  # Lengths of the compared fields
+                    if (rec_num2 in rec_length_cache):  # of data set 1
+                        rec2_len = rec_length_cache[rec_num2]
                     else:
-                        rec2_len = len(''.join(rec2))
-                        rec_length_cache[rec_ident2] = rec2_len
+                        rec2_len = 0
+                        for (code_array, value_list) in comp_col_list1:
+                            rec2_len += len(value_list[code_array[rec_num2]])
+                        rec_length_cache[rec_num2] = rec2_len
 
                     perc_diff = float(abs(rec1_len - rec2_len)) / max(rec1_len, rec2_len)
 
                     if (perc_diff > length_filter_perc):
-                        do_comp = False
                         num_rec_pairs_filtered += 1
+                        continue
 
-                if (do_comp == True):
-                    w_vec = rec_comp(rec1, rec2)
+                rec2 = [value_list[code_array[rec_num2]] for (code_array, value_list) \
+                        in comp_col_list2]
 
-                    if (cut_off_threshold == None) or (sum(w_vec) >= cut_off_threshold):
-                        weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
-                    else:
-                        num_rec_pairs_below_thres += 1
+                yield (rec_num1, rec1, rec_num2, rec2)
 
-        return [self.__get_field_names_list__(), weight_vec_dict]
+    # ---------------------------------------------------------------------------
+
+    def __get_index_parts__(self, field_val_list, index_def):
+        """Compute the parts of index variable values for a list of non-empty
+           (and lower-cased) field values according to the given processed index
+           definition: words are sorted and values reversed if set, then either
+           the encoding function is applied to the whole list with
+           encode.encode_column(), or values are truncated.
+        """
+
+        if (index_def[2] == True):
+            field_val_list = [(' '.join(sorted(field_val.split())) if \
+                               (' ' in field_val) else field_val) \
+                              for field_val in field_val_list]
+
+        if (index_def[3] == True):
+            field_val_list = [field_val[::-1] for field_val in field_val_list]
+
+        funct_def = index_def[5]
+
+        if (funct_def != None):
+            if (len(funct_def) > 4):
+              logging.exception('Too many arguments for function call: %s' % \
+                                (str(funct_def)))
+              raise Exception
+
+            return encode.encode_column(funct_def[0], field_val_list, *funct_def[1:])
+
+        elif (index_def[4] != None):
+            trunc_len = index_def[4]
+
+            return [field_val[:trunc_len] for field_val in field_val_list]
+
+        return field_val_list
 
     # ---------------------------------------------------------------------------
 
-    def __get_index_values__(self, rec, data_set_num):
+    def __get_store_index_values__(self, rec_store, data_set_num, index_num):
+        """An iterator which returns the index variable value of one index for
+           each record in the given record store, in record number order.
+
+           As the store is dictionary-encoded, each index definition is applied
+           only once to every distinct value of a field, and the index variable
+           values of records are then assembled from these parts.
+        """
 
-        index_var_values = []
+        assert (data_set_num == 0) or (data_set_num == 1)
 
         sep_str = self.index_sep_str
 
-        assert (data_set_num == 0) or (data_set_num == 1)
+        code_array_list = []  # Field value codes of all records
 
-        for index_def_list in self.index_def_proc:
+        part_table_list = []  # Index parts of all distinct field values
 
-            index_val_list = []
+        for index_def in self.index_def_proc[index_num]:
 
-            for index_def in index_def_list:
+            field_col = index_def[data_set_num]
 
-                field_col = index_def[data_set_num]
+            # The empty value always has code 0 and gives no part
+            #
+            part_table = [None] + \
+                self.__get_index_parts__(rec_store.col_value_list[field_col][1:],
+                                         index_def)
 
-                if (field_col >= len(rec)):
-                    field_val = ''
-                else:
-                    field_val = rec[field_col].lower()
-
-                if (field_val != ''):
-                    if ((' ' in field_val) and (index_def[2] == True)):
-                        word_list = field_val.split()
-                        word_list.sort()
-                        field_val = ' '.join(word_list)
-
-                    if (index_def[3] == True):
-                        field_val = field_val[::-1]
-
-                    funct_def = index_def[5]
-
-                    if (funct_def != None):
-                        funct_call    =    funct_def[0]
-                        num_funct_arg = len(funct_def)
-
-                        if (num_funct_arg == 1):
-                            funct_val = funct_call(field_val)
-                        elif (num_funct_arg == 2):
-                            funct_val = funct_call(field_val, funct_def[1])
-                        elif (num_funct_arg == 3):
-                            funct_val = funct_call(field_val, funct_def[1], funct_def[2])
-                        elif (num_funct_arg == 4):
-                            funct_val = funct_call(field_val, funct_def[1], funct_def[2], funct_def[3])
-                        else:
-                          logging.exception('Too many arguments for function call: %s' % \
-                                            (str(funct_def)))
-                          raise Exception
-                    else:
-                        funct_val = field_val
+            code_array_list.append(rec_store.col_code_list[field_col])
+
+            part_table_list.append(part_table)
+
+        if (len(code_array_list) == 1):  # Parts are the index values
+            part_table = part_table_list[0]
+
+            for code in code_array_list[0]:
+                index_val = part_table[code]
+
+                if (index_val == None):
+                    index_val = ''
+
+                yield index_val
 
-                        if (index_def[4] != None):
-                            funct_val = funct_val[:index_def[4]]
+        else:
+            code_part_list = zip(code_array_list, part_table_list)
 
-                    index_val_list.append(funct_val)
+            for rec_num in xrange(rec_store.num_records):
 
-            index_val = sep_str.join(index_val_list)
+                index_val_list = []
 
-            index_var_values.append(index_val)
+                for (code_array, part_table) in code_part_list:
+                    part = part_table[code_array[rec_num]]
 
-        assert len(index_var_values) == len(self.index_def_proc)
+                    if (part != None):
+                        index_val_list.append(part)
 
-        return index_var_values
+                yield sep_str.join(index_val_list)
 
 # =============================================================================
 
@@ -428,8 +1358,8 @@ class BlockingIndex(Indexing):
 
         self.num_rec_pairs = 0
 
-        for rec_ident2_set in self.rec_pair_dict.itervalues():
-            self.num_rec_pairs += len(rec_ident2_set)
+        for rec_num2_set in self.rec_pair_dict.itervalues():
+            self.num_rec_pairs += len(rec_num2_set)
 
         self.status = 'compacted'
 
@@ -512,9 +1442,9 @@ class SortingIndex(Indexing):
 
                 new_window_recs = set()
 
-                for rec_ident in this_index[block_val_list[j]]:
-                    if (rec_ident not in curr_window_recs):
-                        new_window_recs.add(rec_ident)
+                for rec_num in this_index[block_val_list[j]]:
+                    if (rec_num not in curr_window_recs):
+                        new_window_recs.add(rec_num)
 
                 w_block_len[window_j] = len(new_window_recs)
 
@@ -535,8 +1465,8 @@ class SortingIndex(Indexing):
 
         self.num_rec_pairs = 0
 
-        for rec_ident2_set in self.rec_pair_dict.itervalues():
-            self.num_rec_pairs += len(rec_ident2_set)
+        for rec_num2_set in self.rec_pair_dict.itervalues():
+            self.num_rec_pairs += len(rec_num2_set)
 
         self.status = 'compacted'
 
@@ -620,14 +1550,14 @@ class SortingArrayIndex(Indexing):
 
                 rec_cnt = 1
 
-                for rec_ident1 in win_rec_id_list:
+                for rec_num1 in win_rec_id_list:
 
-                    rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
+                    rec_num2_set = rec_pair_dict.get(rec_num1, set())
 
-                    for rec_ident2 in win_rec_id_list[rec_cnt:]:
-                        rec_ident2_set.add(rec_ident2)
+                    for rec_num2 in win_rec_id_list[rec_cnt:]:
+                        rec_num2_set.add(rec_num2)
 
-                    rec_pair_dict[rec_ident1] = rec_ident2_set
+                    rec_pair_dict[rec_num1] = rec_num2_set
 
                     rec_cnt += 1
 
@@ -644,8 +1574,8 @@ class SortingArrayIndex(Indexing):
 
         self.num_rec_pairs = 0  # Count lengths of all record identifier sets - - -
 
-        for rec_ident2_set in self.rec_pair_dict.itervalues():
-            self.num_rec_pairs += len(rec_ident2_set)
+        for rec_num2_set in self.rec_pair_dict.itervalues():
+            self.num_rec_pairs += len(rec_num2_set)
 
         self.status = 'compacted'  # Update index status
 
@@ -0,0 +1,150 @@
+# =============================================================================
+"""Module testdata.py - Data sets and value samples shared by the checking and
+   benchmark scripts (testing.py, testing_equivalence.py and benchmark.py).
+
+   census_ds, rest_ds   The census and restaurant data sets
+
+   get_field_values     Values of fields of all records of a data set
+
+   get_distinct_values  Distinct values, their single words and the reversed
+                        values
+
+   sample_values        Random sample of values
+
+   sample_value_pairs   Random sample of value pairs (equal values, values with
+                        a small modification, and random pairs of values)
+
+   All random samples are drawn with the generator 'rand', which has a fixed
+   seed so all runs of a script use the same values.
+"""
+
+# =============================================================================
+
+import os
+import random
+
+import dataset
+
+# =============================================================================
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+rand = random.Random(42)  # Fixed seed so all runs use the same values
+
+CENSUS_NAME_FIELD_LIST = ['surname', 'given_name', 'suburb']
+REST_NAME_FIELD_LIST   = ['name', 'addr', 'city']
+
+# =============================================================================
+
+census_ds = dataset.DataSetCSV(description='Census data set',
+                               access_mode='read',
+                               delimiter='\t',
+                               rec_ident='rec_id',
+                               header_line=False,
+                               field_list=[('relation',0),
+                                           ('entity_id',1),
+                                           ('surname',2),
+                                           ('given_name',3),
+                                           ('middle_initial',4),
+                                           ('zipcode',5),
+                                           ('suburb',6)],
+                               file_name = os.path.join(data_dir, 'census.tab'))
+
+rest_ds = dataset.DataSetCSV(description='Restaurant data set',
+                             access_mode='read',
+                             rec_ident='rec_id',
+                             header_line=True,
+                             file_name = os.path.join(data_dir, 'restaurant.csv'))
+
+# =============================================================================
+
+def get_field_values(ds, field_name_list):
+    """Return the non-empty stripped and lower-cased values of the given fields
+       of all records in the data set (with duplicates, so frequent values are
+       sampled more often).
+    """
+
+    field_col_list = []
+
+    for (field_name, field_col) in ds.field_list:
+        if (field_name in field_name_list):
+            field_col_list.append(field_col)
+
+    val_list = []
+
+    for (rec_ident, rec) in ds.readall():
+        for field_col in field_col_list:
+            if (field_col < len(rec)) and (rec[field_col].strip() != ''):
+                val_list.append(rec[field_col].strip().lower())
+
+    return val_list
+
+# -----------------------------------------------------------------------------
+
+def get_distinct_values(val_list):
+    """Return the distinct values of the given list, their single words, and
+       the reversed values (as used by index definitions), as a sorted list.
+    """
+
+    val_set = set()
+
+    for val in val_list:
+        val_set.add(val)
+        val_set.add(val[::-1])
+        val_set.update(val.split())
+
+    return sorted(val_set)
+
+# -----------------------------------------------------------------------------
+
+def sample_values(val_list, num_vals):
+    """Return a random sample (with replacement) of the given values.
+    """
+
+    return [rand.choice(val_list) for i in range(num_vals)]
+
+# -----------------------------------------------------------------------------
+
+def modify_value(val):
+    """Return the value with one character inserted, deleted or substituted.
+    """
+
+    pos = rand.randint(0, len(val)-1)
+    char = rand.choice('abcdefghijklmnopqrstuvwxyz')
+
+    return rand.choice([val[:pos]+char+val[pos:], val[:pos]+val[pos+1:],
+                        val[:pos]+char+val[pos+1:]])
+
+# -----------------------------------------------------------------------------
+
+def sample_value_pairs(val_list, num_pairs, equal_pairs = True):
+    """Return a sample of value pairs: a third of them equal values, a third
+       values with a small modification, and a third random pairs of values.
+       Without equal pairs, half of them are values with a small modification
+       and half random pairs of values.
+    """
+
+    if (equal_pairs == True):
+        pair_type_list = ['equal', 'modified', 'random']
+    else:
+        pair_type_list = ['modified', 'random']
+
+    pair_list = []
+
+    for i in range(num_pairs):
+        val1 = rand.choice(val_list)
+
+        pair_type = pair_type_list[i % len(pair_type_list)]
+
+        if (pair_type == 'equal'):
+            val2 = val1
+        elif (pair_type == 'modified'):
+            val2 = modify_value(val1)
+        else:
+            val2 = rand.choice(val_list)
+
+        pair_list.append((val1, val2))
+
+    return pair_list
+
+# =============================================================================
@@ -1,6 +1,83 @@
-import jellyfish
 
-result = jellyfish.jaro_distance(u'hello', u'hello_1')
+# =============================================================================
+"""Check that the string similarity backends of the approximate field
+   comparators agree.
 
-print (result);
+   Value pairs are drawn from the census and restaurant data sets (values with
+   a small modification, and random pairs of values), and the Jaro
+   similarity computed by the pure Python implementation is compared with the
+   one computed by the jellyfish module. The two implementations count common
+   characters and transpositions slightly differently, so the similarities
+   are only required to agree within a tolerance.
 
+   Usage: python testing.py [-tolerance DIFF] [-num_pairs NUM]
+"""
+
+# =============================================================================
+
+import argparse
+import sys
+
+import comparison
+import testdata
+
+# =============================================================================
+
+arg_parser = argparse.ArgumentParser(description='Check the agreement of ' + \
+                                     'the string similarity backends')
+arg_parser.add_argument('-tolerance', metavar='DIFF', type=float, default=0.06,
+                        help='allowed absolute difference of the ' + \
+                             'similarities (default 0.06)')
+arg_parser.add_argument('-num_pairs', metavar='NUM', type=int, default=100000,
+                        help='number of value pairs per data set ' + \
+                             '(default 100000)')
+args = arg_parser.parse_args()
+
+if (comparison.jellyfish == None):
+    print 'The jellyfish module is not installed, only the Python backend ' + \
+          'is available'
+    sys.exit(0)
+
+# =============================================================================
+
+python_comp    = comparison.FieldComparatorJaro(thres=0, backend='python')
+jellyfish_comp = comparison.FieldComparatorJaro(thres=0, backend='jellyfish')
+
+test_list = [('census',     testdata.get_field_values(testdata.census_ds,
+                                        testdata.CENSUS_NAME_FIELD_LIST)),
+             ('restaurant', testdata.get_field_values(testdata.rest_ds,
+                                        testdata.REST_NAME_FIELD_LIST))]
+
+num_failed = 0
+
+for (test_name, val_list) in test_list:
+
+    max_diff  = 0.0
+    num_diff  = 0
+    max_pair  = None
+
+    for (val1, val2) in testdata.sample_value_pairs(val_list, args.num_pairs,
+                                                    False):
+
+        diff = abs(python_comp.compare(val1, val2) - \
+                   jellyfish_comp.compare(val1, val2))
+
+        if (diff > 1.0E-9):
+            num_diff += 1
+
+        if (diff > max_diff):
+            max_diff = diff
+            max_pair = (val1, val2)
+
+    print '%-10s  %d value pairs, %d differ, maximum difference: %.6f' % \
+          (test_name, args.num_pairs, num_diff, max_diff)
+
+    if (max_diff > args.tolerance):
+        print '  Difference larger than tolerance %.6f for values "%s" and "%s"' \
+              % (args.tolerance, max_pair[0], max_pair[1])
+        num_failed += 1
+
+if (num_failed > 0):
+    sys.exit(1)
+
+print 'Backends agree within tolerance %.6f' % (args.tolerance)
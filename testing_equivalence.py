@@ -0,0 +1,307 @@
+
+# =============================================================================
+"""Check that reworked encoding and comparison functions give the same results
+   as the implementations they replaced, and that new encoding functions give
+   the expected codes.
+
+   Frozen copies of the previous implementations are kept in this script, and
+   their results are compared with the current functions on the values of the
+   census and restaurant data sets (whole values, their single words, and the
+   reversed values, as used by index definitions).
+
+   nysiis  The current encode.nysiis() against the original string
+           replacement based implementation, for several maximum code lengths.
+
+   jaro    The weights of the current Jaro field comparator with the Python
+           backend against the original string copying implementation, on
+           value pairs (a value and the value with one character inserted,
+           deleted or substituted, and random pairs of values) for several
+           thresholds.
+
+   metaphone  The current encode.metaphone() against known codes of values
+              with repeated letters and special letter combinations.
+
+   Usage: python testing_equivalence.py
+"""
+
+# =============================================================================
+
+import string
+import sys
+
+import comparison
+import encode
+import testdata
+
+# =============================================================================
+
+NYSIIS_MAXLEN_LIST = [0, 3, 4, 6, 8]
+
+JARO_THRES_LIST = [0.0, 0.3, 0.5, 0.7, 0.8, 0.9, 0.95]
+JARO_NUM_PAIRS  = 20000  # Number of value pairs per data set
+
+# Values and their expected Metaphone codes (of unlimited length)
+#
+METAPHONE_CODE_LIST = [('mccarthy', 'mkr0'), ('mcarthy',  'mkr0'),
+                       ('accident', 'akstnt'), ('bacchus', 'pks'),
+                       ('mcclure',  'mklr'), ('schmidt',  'skmt'),
+                       ('knight',   'nt'), ('thompson', '0mpsn')]
+
+# =============================================================================
+# Frozen previous implementations
+
+def nysiis_ref(s, maxlen=4):
+    """Compute the NYSIIS code for a string (original implementation).
+    """
+
+    if (not s):
+        return ''
+
+    # Remove trailing S or Z
+    #
+    while s and s[-1] in 'sz':
+        s = s[:-1]
+
+    # Translate first characters of string
+    #
+    if (s[:3] == 'mac'):  # Initial 'MAC' -> 'MC'
+        s = 'mc'+s[3:]
+    elif (s[:2] == 'pf'):  # Initial 'PF' -> 'F'
+        s = s[1:]
+
+    # Translate some suffix characters:
+    #
+    suff_dict = {'ix':'ic', 'ex':'ec', 'ye':'y', 'ee':'y', 'ie':'y', 'dt':'d', 'rt':'d', 'rd':'d', 'nt':'n', 'nd':'n'}
+
+    suff = s[-2:]
+
+    s = s[:-2]+suff_dict.get(suff, suff)
+
+    # Replace EV with EF
+    #
+
+    if (s[2:].find('ev') > -1):
+        s = s[:-2]+s[2:].replace('ev','ef')
+
+    if (not s):
+        return ''
+
+    first = s[0]  # Save first letter for final code
+
+    # Replace all vowels with A and delete whitespaces
+    #
+    voweltable = string.maketrans('eiou', 'aaaa')
+
+    s2 = string.translate(s,voweltable, ' ')
+
+    if (not s2):  # String only contained whitespaces
+        return ''
+
+    # Remove all W that follow an A
+    #
+    s2 = s2.replace('aw','a')
+
+    # Various replacement patterns
+    #
+    s2 = s2.replace('ght','gt')
+    s2 = s2.replace('dg','g')
+    s2 = s2.replace('ph','f')
+    s2 = s2[0]+s2[1:].replace('ah','a')
+    s3 = s2[0]+s2[1:].replace('ha','a')
+    s3 = s3.replace('kn','n')
+    s3 = s3.replace('k','c')
+    s4 = s3[0]+s3[1:].replace('m','n')
+    s5 = s4[0]+s4[1:].replace('q','g')
+    s5 = s5.replace('sh','s')
+    s5 = s5.replace('sch','s')
+    s5 = s5.replace('yw','y')
+    s5 = s5.replace('wr','r')
+
+    # If not first or last, replace Y with A
+    #
+    s6 = s5[0]+s5[1:-1].replace('y','a')+s5[-1]
+
+    # If not first character, replace Z with S
+    #
+    s7 = s6[0]+s6[1:].replace('z','s')
+
+    # Replace trailing AY with Y
+    #
+    if (s7[-2:] == 'ay'):
+        s7 = s7[:-2]+'y'
+
+    # Remove trailing vowels (now only A)
+    #
+    while s7 and s7[-1] == 'a':
+        s7 = s7[:-1]
+
+    if (len(s7) == 0):
+        resstr = ''
+    else:
+        resstr = s7[0]
+        for i in s7[1:]:
+            if (i != resstr[-1]):
+                resstr=resstr+i
+
+    # Now compile final result string
+    #
+    if (first in 'aeiou'):
+        resstr = first+resstr[1:]
+
+    if (maxlen > 0):
+        resstr = resstr[:maxlen]  # Return first maxlen characters
+
+    return resstr
+
+# -----------------------------------------------------------------------------
+
+class FieldComparatorJaroRef(comparison.FieldComparatorApproxString):
+    """The Jaro field comparator (original implementation).
+    """
+
+    def __init__(self, **kwargs):
+        comparison.FieldComparatorApproxString.__init__(self, kwargs)
+
+        self.JARO_MARKER_CHAR = chr(1)  # Special character used to mark assigned
+                                    # characters
+
+    def compare(self, val1, val2):
+
+        # Check if one of the values is a missing value
+        #
+        if (val1 in self.missing_values) or (val2 in self.missing_values):
+            return self.missing_weight
+
+
+        if (val1 == val2):
+            return self.__calc_freq_agree_weight__(val1)
+
+        # Calculate Jaro similarity value - - - - - - - - - - - - - - - - - - - - -
+        #
+        len1, len2 = len(val1), len(val2)
+
+        halflen = max(len1, len2) / 2 - 1
+
+        ass1, ass2 = '', ''  # Characters assigned in string 1 and string 2
+
+        workstr1, workstr2 = val1, val2  # Copies of the original strings
+
+        common1, common2 = 0.0, 0.0  # Number of common characters
+
+        for i in range(len1):  # Analyse the first string
+            start = max(0,i-halflen)
+            end   = min(i+halflen+1,len2)
+            index = workstr2.find(val1[i],start,end)
+            if (index > -1):  # Found common character
+                common1 += 1
+                ass1 = ass1 + val1[i]
+                workstr2 = workstr2[:index]+self.JARO_MARKER_CHAR+workstr2[index+1:]
+
+        for i in range(len2):  # Analyse the second string
+            start = max(0,i-halflen)
+            end   = min(i+halflen+1,len1)
+            index = workstr1.find(val2[i],start,end)
+            if (index > -1):  # Found common character
+                common2 += 1
+                ass2 = ass2 + val2[i]
+                workstr1 = workstr1[:index]+self.JARO_MARKER_CHAR+workstr1[index+1:]
+
+        assert (common1 == common2), 'Jaro: Different "common" values'
+
+        if (common1 == 0.0):  # No characters in common
+            w = self.disagree_weight
+        else:  # Compute number of transpositions  - - - - - - - - - - - - - - - -
+
+            transp = 0.0
+            for i in range(len(ass1)):
+                if (ass1[i] != ass2[i]):
+                    transp += 0.5
+
+            w = 1./3.*(common1 / float(len1) + common1 / float(len2) + (common1-transp) / common1)
+
+            assert (w > 0.0), 'Jaro: Weight is smaller than 0.0: %f' % (w)
+
+            assert (w < 1.0), 'Jaro: Weight is larger than 1.0: %f' % (w)
+
+            w = self.__calc_partagree_weight__(val1, val2, w)
+
+        return w
+
+# =============================================================================
+
+census_val_list = testdata.get_field_values(testdata.census_ds,
+                                            testdata.CENSUS_NAME_FIELD_LIST)
+rest_val_list   = testdata.get_field_values(testdata.rest_ds,
+                                            testdata.REST_NAME_FIELD_LIST)
+
+value_list_list = [('census',     testdata.get_distinct_values(census_val_list)),
+                   ('restaurant', testdata.get_distinct_values(rest_val_list))]
+
+# =============================================================================
+
+num_failed = 0
+
+for (test_name, val_list) in value_list_list:
+
+    num_cases = 0
+    num_diff  = 0
+
+    for val in val_list:
+        for maxlen in NYSIIS_MAXLEN_LIST:
+            num_cases += 1
+
+            if (encode.nysiis(val, maxlen) != nysiis_ref(val, maxlen)):
+                if (num_diff == 0):
+                    print '  First difference for value "%s" and maxlen %d' % \
+                          (val, maxlen)
+                num_diff += 1
+
+    print '%-22s %-10s  %d cases, %d differ' % ('nysiis', test_name,
+                                                num_cases, num_diff)
+    if (num_diff > 0):
+        num_failed += 1
+
+for (test_name, val_list) in value_list_list:
+
+    pair_list = testdata.sample_value_pairs(val_list, JARO_NUM_PAIRS, False)
+
+    num_cases = 0
+    num_diff  = 0
+
+    for thres in JARO_THRES_LIST:
+        jaro_comp     = comparison.FieldComparatorJaro(thres=thres,
+                                                       backend='python')
+        jaro_ref_comp = FieldComparatorJaroRef(thres=thres)
+
+        for (val1, val2) in pair_list:
+            num_cases += 1
+
+            if (abs(jaro_comp.compare(val1, val2) - \
+                    jaro_ref_comp.compare(val1, val2)) > 1.0E-9):
+                if (num_diff == 0):
+                    print '  First difference for values "%s" and "%s" and ' % \
+                          (val1, val2) + 'threshold %.2f' % (thres)
+                num_diff += 1
+
+    print '%-22s %-10s  %d cases, %d differ' % ('jaro', test_name,
+                                                num_cases, num_diff)
+    if (num_diff > 0):
+        num_failed += 1
+
+num_diff = 0
+
+for (val, code) in METAPHONE_CODE_LIST:
+    if (encode.metaphone(val, 0) != code):
+        print '  Code of value "%s" is "%s", expected "%s"' % \
+              (val, encode.metaphone(val, 0), code)
+        num_diff += 1
+
+print '%-22s %-10s  %d cases, %d differ' % ('metaphone', 'known',
+                                            len(METAPHONE_CODE_LIST), num_diff)
+if (num_diff > 0):
+    num_failed += 1
+
+if (num_failed > 0):
+    sys.exit(1)
+
+print 'All functions give the expected results'